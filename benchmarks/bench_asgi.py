@@ -0,0 +1,156 @@
+"""
+Slow concurrent clients served by gunicorn sync workers and by uvicorn running the ASGI update application.
+
+Both servers run the public application of benchmarks/servers.py as subprocesses on a synthetic catalog of
+--packs service packs and are measured over real sockets. Clients connect at --rate connections per second
+and read their response at --client-bandwidth KB/s through a small receive buffer, like clients on a slow link.
+Two scenarios are measured:
+
+    listing   the service pack listing. A sync worker is tied up until the response fits into the kernel's
+              socket buffers, which on loopback often hold all of it, so the difference may be small.
+    wait      long polls of the newest version for --wait-timeout seconds. A sync worker is tied up for the
+              whole wait, so gunicorn holds at most --workers of them at once and the others queue, while
+              uvicorn only holds a coroutine per connection.
+
+    python -m benchmarks.bench_asgi [--packs 500] [--connections 200] [--rate 100] [--workers 4]
+                                    [--client-bandwidth 1024] [--wait-timeout 1]
+
+Needs gunicorn and uvicorn, see deployment/requirements/prod.txt.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from iqupdate.synthetic_database import init_synthetic_database
+from benchmarks.common import benchmark_app, percentile
+
+REQUEST = 'GET {} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+# Bytes a client reads at once, also the size of its receive buffer
+READ_SIZE = 16384
+
+
+def _free_port():
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        return listener.getsockname()[1]
+
+
+def _wait_until_listening(server, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('Server exited with {}'.format(server.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Server did not listen on port {} within {}s'.format(port, timeout))
+
+
+def start_server(kind, database_uri, port, workers):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if kind == 'gunicorn':
+        command = [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()', '--worker-class', 'sync',
+                   '--workers', str(workers), '--bind', '127.0.0.1:{}'.format(port), '--backlog', '2048',
+                   'benchmarks.servers:wsgi_application']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(port), '--backlog', '2048',
+                   '--log-level', 'warning', '--no-access-log', 'benchmarks.servers:asgi_application']
+    environment = dict(os.environ, IQUPDATE_BENCHMARK_DATABASE_URI=database_uri)
+    server = subprocess.Popen(command, cwd=root, env=environment)
+    try:
+        _wait_until_listening(server, port)
+    except Exception:
+        server.kill()
+        raise
+    return server
+
+
+async def _request(port, path, read_delay):
+    started = time.perf_counter()
+    client = socket.socket()
+    # Set before connecting, so the advertised window stays small and the server has to wait for the client
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, READ_SIZE)
+    client.setblocking(False)
+    await asyncio.get_event_loop().sock_connect(client, ('127.0.0.1', port))
+    reader, writer = await asyncio.open_connection(sock=client, limit=READ_SIZE)
+    try:
+        writer.write(REQUEST.format(path).encode('latin-1'))
+        await writer.drain()
+        response = b''
+        while True:
+            chunk = await reader.read(READ_SIZE)
+            if not chunk:
+                break
+            response += chunk
+            await asyncio.sleep(read_delay)
+    finally:
+        writer.close()
+    assert response.split(b' ', 2)[1] == b'200', response[:100]
+    return time.perf_counter() - started
+
+
+def measure(port, path, connections, rate, read_delay):
+    """
+    Open connections to path at rate per second and return the total seconds and the latency of every request.
+    """
+    async def arrive(index):
+        await asyncio.sleep(index / rate)
+        return await _request(port, path, read_delay)
+
+    async def run():
+        return await asyncio.gather(*[arrive(index) for index in range(connections)])
+
+    started = time.perf_counter()
+    durations = asyncio.run(run())
+    return time.perf_counter() - started, durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--packs', type=int, default=500)
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--client-bandwidth', type=float, default=1024, help='KB/s read by every client')
+    parser.add_argument('--wait-timeout', type=float, default=1)
+    args = parser.parse_args()
+    read_delay = READ_SIZE / (args.client_bandwidth * 1024)
+    scenarios = (
+        ('listing', '/iq7/v1/updates'),
+        ('wait', '/iq7/v1/updates/wait?version={}&timeout={}'.format(args.packs, args.wait_timeout)),
+    )
+
+    def init_database(app):
+        init_synthetic_database(app, packs=args.packs, languages=('de', 'en'), note_size=256)
+
+    results = {}
+    with benchmark_app(init_database) as app:
+        database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+        for name, kind in (('gunicorn_sync_workers', 'gunicorn'), ('uvicorn_asgi', 'uvicorn')):
+            port = _free_port()
+            server = start_server(kind, database_uri, port, args.workers)
+            try:
+                # One request first, so neither server is measured loading the catalog
+                measure(port, scenarios[0][1], 1, 1, 0)
+                for scenario, path in scenarios:
+                    elapsed, durations = measure(port, path, args.connections, args.rate, read_delay)
+                    results['{}_{}'.format(scenario, name)] = {
+                        'seconds': round(elapsed, 3),
+                        'connections_per_second': round(args.connections / elapsed, 1),
+                        'p50_ms': round(percentile(durations, 0.5) * 1000, 3),
+                        'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+                    }
+            finally:
+                server.terminate()
+                server.wait()
+    print(json.dumps({'parameters': vars(args), 'results': results}, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Requests/second of /iq7/v1/updates?hasUpdatesFor=N, the query-per-request implementation
+against the cached fast path.
+
+    python -m benchmarks.bench_has_updates [--requests 2000]
+"""
+import argparse
+from flask import request
+from iqupdate.models import ServicePack
+from benchmarks.common import benchmark_app, requests_per_second
+
+
+def add_legacy_view(app):
+    @app.route('/bench/legacy/updates')
+    def legacy_updates_view():
+        version_number = int(request.args['hasUpdatesFor'])
+        service_packs = ServicePack.query.order_by(ServicePack.release_date).filter(
+            ServicePack.version_number > version_number).all()
+        return 'true' if len(service_packs) > 0 else 'false'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    with benchmark_app() as app:
+        add_legacy_view(app)
+        client = app.test_client()
+        for name, url in (('before (query per request)', '/bench/legacy/updates?hasUpdatesFor=0161'),
+                          ('after (cached newest version)', '/iq7/v1/updates?hasUpdatesFor=0161')):
+            requests_per_second(client, url, 50)
+            print('{:<32} {:>10.0f} requests/s'.format(name, requests_per_second(client, url, args.requests)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Logins/second of one worker process, with the password hashes checked on the login verification pool.
+
+    python -m benchmarks.bench_login [--logins 200] [--concurrency 1,4,16]
+"""
+import argparse
+import sys
+import threading
+import time
+from benchmarks.common import benchmark_app
+
+
+def login_rate(app, logins, concurrency):
+    """
+    Successful logins per second of concurrency threads sharing the app, each logging in and out again.
+    Logins turned away with 503 by the full pool are counted separately.
+    """
+    counts = {'logins': 0, 'rejected': 0}
+    lock = threading.Lock()
+
+    def run(count):
+        client = app.test_client()
+        for _ in range(count):
+            rv = client.post('/admin/login/', data={'email': 'release', 'password': 'release'})
+            assert rv.status_code in (302, 503), rv.status_code
+            with lock:
+                counts['logins' if rv.status_code == 302 else 'rejected'] += 1
+            client.get('/admin/logout/')
+
+    threads = [threading.Thread(target=run, args=(logins // concurrency,)) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts['logins'] / (time.perf_counter() - started), counts['rejected']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma separated numbers of concurrent clients.')
+    args = parser.parse_args()
+
+    with benchmark_app() as app:
+        # Every client shares one address, only the verification pool should limit them
+        app.config['LOGIN_ATTEMPTS'] = sys.maxsize
+        login_rate(app, 10, 1)
+        print('{} verification threads, {} queued'.format(app.config['LOGIN_VERIFY_THREADS'],
+                                                          app.config['LOGIN_VERIFY_QUEUE']))
+        for concurrency in [int(value) for value in args.concurrency.split(',')]:
+            rate, rejected = login_rate(app, args.logins, concurrency)
+            print('{:>3} clients {:>10.1f} logins/s {:>6} rejected'.format(concurrency, rate, rejected))
+
+
+if __name__ == '__main__':
+    main()
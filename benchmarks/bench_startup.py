@@ -0,0 +1,60 @@
+"""
+Start-up time, peak RSS and loaded modules of a worker built by the full and by the public app factory.
+
+    python -m benchmarks.bench_startup [--runs 5]
+
+Every run is a fresh interpreter, which imports the package, builds the application and answers
+one hasUpdatesFor request.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+WORKER = '''
+import json, resource, sys, tempfile, time
+started = time.perf_counter()
+from config import Config
+from iqupdate import {factory}, db
+db_fd, db_path = tempfile.mkstemp()
+config = Config(True, 'sqlite:///' + db_path)
+config.SQLALCHEMY_ECHO = False
+app = {factory}(config)
+{init_views}
+with app.app_context():
+    db.create_all()
+assert app.test_client().get('/iq7/v1/updates?hasUpdatesFor=0161').status_code == 200
+print(json.dumps({{'seconds': time.perf_counter() - started, 'modules': len(sys.modules),
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}}))
+'''
+
+FACTORIES = (
+    ('full (create_app + init_views)', WORKER.format(
+        factory='create_app', init_views='from iqupdate import views\nviews.init_views(app)')),
+    ('public (create_public_app)', WORKER.format(factory='create_public_app', init_views='')),
+)
+
+
+def measure(script, runs):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+        results.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+    return dict((key, min(result[key] for result in results)) for key in ('seconds', 'modules', 'rss_mb'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, script in FACTORIES:
+        result = measure(script, args.runs)
+        print('{:<32} {:>8.3f} s {:>8.1f} MB RSS {:>6} modules'.format(
+            name, result['seconds'], result['rss_mb'], result['modules']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from config import Config
+from iqupdate import create_app, db, views
+from iqupdate.example_database import init_example_database
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_ECHO = False
+    WTF_CSRF_ENABLED = False
+    # Logins are measured with the production hash
+    TESTING_PASSWORD_HASH_OPTIONS = None
+
+
+@contextmanager
+def benchmark_app(init_database=init_example_database):
+    """
+    Full application on a temporary SQLite file filled by init_database(app).
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app(BenchmarkConfig(True, 'sqlite:///' + db_path))
+    views.init_views(app)
+    with app.app_context():
+        db.create_all()
+    init_database(app)
+    try:
+        yield app
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def time_requests(client, requests, count):
+    """
+    Issue count requests cycling through requests, a list of (method, url, kwargs), and return their durations.
+    """
+    durations = []
+    for index in range(count):
+        method, url, kwargs = requests[index % len(requests)]
+        started = time.perf_counter()
+        rv = client.open(url, method=method, **kwargs)
+        durations.append(time.perf_counter() - started)
+        assert rv.status_code == 200, (url, rv.status_code)
+    return durations
+
+
+def percentile(durations, fraction):
+    ordered = sorted(durations)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(durations):
+    return {
+        'requests': len(durations),
+        'p50_ms': round(percentile(durations, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+        'throughput_rps': round(len(durations) / sum(durations), 1),
+    }
+
+
+def requests_per_second(client, url, count):
+    return summarize(time_requests(client, [('GET', url, {})], count))['throughput_rps']
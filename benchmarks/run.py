@@ -0,0 +1,79 @@
+"""
+Latency and throughput of the update endpoints and the ServicePackAdmin list page on a synthetic catalog.
+
+    python -m benchmarks.run [--packs 5000] [--languages de,en] [--note-size 4096] [--requests 500]
+                             [--output results.json]
+
+Results are printed as a table and, with --output, written as JSON so runs can be diffed between releases.
+"""
+import argparse
+import json
+import platform
+import sys
+from iqupdate.example_database import init_example_database
+from iqupdate.synthetic_database import init_synthetic_database
+from benchmarks.common import benchmark_app, time_requests, summarize
+
+
+def endpoint_requests(packs, languages):
+    newest = packs
+    versions = range(max(1, packs - 50), packs + 1)
+    return [
+        ('updates_list', [('GET', '/iq7/v1/updates', {})]),
+        ('updates_list_recent', [('GET', '/iq7/v1/updates?greaterThan={:04d}'.format(max(0, newest - 10)), {})]),
+        ('has_updates_for', [('GET', '/iq7/v1/updates?hasUpdatesFor={:04d}'.format(newest - 1), {})]),
+        ('service_pack_info', [('GET', '/iq7/v1/updates/{:04d}?language={}'.format(version, language), {})
+                               for version in versions for language in languages]),
+        ('service_pack_info_gzip', [('GET', '/iq7/v1/updates/{:04d}?language={}'.format(version, language),
+                                     {'headers': {'Accept-Encoding': 'gzip'}})
+                                    for version in versions for language in languages]),
+        ('updates_json', [('GET', '/iq7/v2/updates?since={:04d}'.format(max(0, newest - 10)), {})]),
+        ('updates_batch', [('POST', '/iq7/v1/updates/check',
+                            {'json': {'installed': list(range(1, packs + 1, max(1, packs // 200)))}})]),
+        ('admin_service_pack_list', [('GET', '/admin/servicepack/', {})]),
+    ]
+
+
+def run_suite(packs=5000, languages=('de', 'en'), note_size=4096, requests=500, warmup=10):
+    def init_database(app):
+        init_synthetic_database(app, packs=packs, languages=languages, note_size=note_size)
+        init_example_database(app)
+
+    results = {}
+    with benchmark_app(init_database) as app:
+        public_client = app.test_client()
+        admin_client = app.test_client()
+        admin_client.post('/admin/login/', data={'email': 'release', 'password': 'release'})
+        for name, endpoint in endpoint_requests(packs, languages):
+            client = admin_client if name.startswith('admin_') else public_client
+            time_requests(client, endpoint, warmup)
+            results[name] = summarize(time_requests(client, endpoint, requests))
+    return {
+        'parameters': {'packs': packs, 'languages': list(languages), 'note_size': note_size, 'requests': requests},
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--packs', type=int, default=5000)
+    parser.add_argument('--languages', default='de,en')
+    parser.add_argument('--note-size', type=int, default=4096)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    report = run_suite(args.packs, args.languages.split(','), args.note_size, args.requests)
+    print('{:<26} {:>10} {:>10} {:>12}'.format('endpoint', 'p50 ms', 'p99 ms', 'requests/s'))
+    for name, result in report['results'].items():
+        print('{:<26} {:>10} {:>10} {:>12}'.format(name, result['p50_ms'], result['p99_ms'],
+                                                   result['throughput_rps']))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+"""
+Public update application on the database at IQUPDATE_BENCHMARK_DATABASE_URI, for bench_asgi to serve with
+real servers:
+
+    gunicorn benchmarks.servers:wsgi_application
+    uvicorn benchmarks.servers:asgi_application
+"""
+import os
+from iqupdate import create_public_app
+from iqupdate.asgi import CatalogASGIApp
+from benchmarks.common import BenchmarkConfig
+
+
+class ServerBenchmarkConfig(BenchmarkConfig):
+    # Lets the benchmark measure what waiting clients cost the sync workers
+    UPDATES_WAIT_ON_WSGI = True
+
+
+wsgi_application = create_public_app(ServerBenchmarkConfig(True, os.environ['IQUPDATE_BENCHMARK_DATABASE_URI']))
+asgi_application = CatalogASGIApp(wsgi_application, threads=wsgi_application.config['ASGI_THREADS'])
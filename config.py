@@ -5,13 +5,27 @@ class Config(object):
     SECRET_KEY = 'This is a secret key for IQUpdate@Apis'
 
     # Create in-memory database
-    SQLALCHEMY_ECHO = True
+    SQLALCHEMY_ECHO = False
+    # Statements taking this many seconds are logged with their parameters and endpoint and listed by shape,
+    # with their EXPLAIN output, on the admin's "Slow queries" page. None turns the recorder off.
+    SLOW_QUERY_THRESHOLD = 0.1
+    SLOW_QUERY_EXPLAIN = True
+    SLOW_QUERY_MAX_STATEMENTS = 200
     SQLALCHEMY_TRACK_MODIFICATIONS = True
+    # Read replicas for the public update views, Flask-Admin and all writes use SQLALCHEMY_DATABASE_URI.
+    # A browser session that just committed keeps reading from the primary for SQLALCHEMY_REPLICA_LAG seconds.
+    SQLALCHEMY_REPLICA_URIS = []
+    SQLALCHEMY_REPLICA_LAG = 5
 
     # Flask-Security config
     SECURITY_URL_PREFIX = "/admin"
     SECURITY_PASSWORD_HASH = "pbkdf2_sha512"
     SECURITY_PASSWORD_SALT = "This is a password salt for IQUpdate@Apis"
+    # The cost can be changed with SECURITY_PASSWORD_HASH_OPTIONS, e.g. {'pbkdf2_sha512': {'rounds': 50000}}.
+    # Stored hashes with fewer rounds are replaced on the next successful login.
+    # Used instead of SECURITY_PASSWORD_HASH_OPTIONS when TESTING is set, tests create and log in users far too
+    # often for the production cost. None keeps the production cost.
+    TESTING_PASSWORD_HASH_OPTIONS = {'pbkdf2_sha512': {'rounds': 1000}}
 
     # Flask-Security URLs, overridden because they don't put a / at the end
     SECURITY_LOGIN_URL = "/login/"
@@ -19,12 +33,85 @@ class Config(object):
 
     SECURITY_POST_LOGIN_VIEW = "/admin/"
     SECURITY_POST_LOGOUT_VIEW = "/admin/"
+    # Seconds a process caches a user's roles for the admin access checks. Saving or deleting a user or role
+    # in the admin clears the cache of that process, the other processes see the change after the timeout.
+    ROLE_CACHE_TIMEOUT = 60
+    # Passwords are verified on LOGIN_VERIFY_THREADS threads with up to LOGIN_VERIFY_QUEUE logins waiting,
+    # more concurrent logins get 503. A client address, see PROXY_FIX_X_FOR, may try to log in LOGIN_ATTEMPTS
+    # times per LOGIN_ATTEMPTS_WINDOW seconds in each worker process, so in up to LOGIN_ATTEMPTS times the
+    # number of workers in total.
+    LOGIN_VERIFY_THREADS = 2
+    LOGIN_VERIFY_QUEUE = 8
+    LOGIN_VERIFY_TIMEOUT = 10
+    LOGIN_ATTEMPTS = 10
+    LOGIN_ATTEMPTS_WINDOW = 60
 
     # Bable default config
     BABEL_DEFAULT_LOCALE = 'en'
     BABEL_DEFAULT_TIMEZONE = 'UTC'
 
+    # Every process caches the service pack catalog. A change saved by one process reaches the others within
+    # CATALOG_CHECK_INTERVAL seconds, through the catalog_generation table. Snapshots are reloaded after
+    # CATALOG_CACHE_TIMEOUT seconds in any case, for rows changed directly in the database.
+    CATALOG_CHECK_INTERVAL = 5
+    CATALOG_CACHE_TIMEOUT = 600
+    # Cache-Control max-age of the public update views, clients revalidate with ETag afterwards
+    UPDATES_CACHE_MAX_AGE = 300
+    # Maximum number of installations a license server may check in with one batch request
+    UPDATES_BATCH_LIMIT = 1000
+    # Default and maximum number of service packs per page of the JSON update API
+    UPDATES_PAGE_LIMIT = 100
+    # Cumulative release notes: ranges cached per catalog snapshot, and the number of service packs
+    # above which a range is streamed instead of built and cached in memory
+    UPDATES_NOTES_CACHE_SIZE = 256
+    UPDATES_NOTES_STREAM_THRESHOLD = 50
+    # Release notes of single service packs with their gzip encoding, most recently used first, per process.
+    # Notes of service packs a catalog change didn't touch stay cached.
+    RELEASE_NOTE_CACHE_SIZE = 2048
+
+    # Longest a long-poll request waits for a new release, and an event stream stays open with its heartbeats
+    UPDATES_WAIT_TIMEOUT = 60
+    UPDATES_EVENTS_TIMEOUT = 300
+    UPDATES_EVENTS_HEARTBEAT = 15
+    # The waiting routes are served by the ASGI application (iq_update_asgi.py). WSGI workers only serve them
+    # when this is set, each waiting client then holds a request thread.
+    UPDATES_WAIT_ON_WSGI = False
+
+    # Directory the public update data is exported to as static files, see iqupdate/static_export.py.
+    # None disables the export, otherwise it is written again whenever a service pack is saved or deleted.
+    STATIC_EXPORT_DIR = None
+
+    # Worker threads of the ASGI update server for requests that may query the database
+    ASGI_THREADS = 4
+
+    # Number of reverse proxies in front of the application that set X-Forwarded-For. 0 trusts no proxy,
+    # request.remote_addr is then the address of the peer, the proxy itself when there is one.
+    PROXY_FIX_X_FOR = 0
+
+    # Request latency, SQL and template timings on /metrics, readable from METRICS_ALLOWED_ADDRESSES (client
+    # addresses, see PROXY_FIX_X_FOR) and by superusers
+    METRICS_ENABLED = True
+    METRICS_ALLOW_SUPERUSER = True
+    METRICS_ALLOWED_ADDRESSES = []
+
+    # Log files in LOG_DIR, shared by all workers and rotated by logrotate, see deployment/logrotate.conf. With
+    # LOG_QUEUE request threads only queue log records and a background thread writes them in batches of
+    # LOG_BATCH_SIZE, dropping records while LOG_QUEUE_SIZE are waiting. LOG_ACCESS_JSON adds access.log with one
+    # JSON line and the latency of every request.
+    LOG_DIR = 'logs'
+    LOG_QUEUE = True
+    LOG_QUEUE_SIZE = 10000
+    LOG_BATCH_SIZE = 100
+    LOG_ACCESS_JSON = False
+    # Share of 404s logged, scanners probing for URLs would flood the log otherwise
+    LOG_404_SAMPLE_RATE = 0.01
+
+    # Czech Deutsch English Spanish French Italian Hungarian Korean Chinese(Taiwan) Chinese(Simplified) Japanese
     LANGUAGES = ['cs', 'de', 'en', 'es', 'fr', 'it', 'hu', 'ko', 'zh_tw', 'zh', 'ja']
+    # Extra fallbacks tried after a language and before its primary subtag and BABEL_DEFAULT_LOCALE,
+    # e.g. {'zh_tw': ['zh']}. Negotiated chains are cached per Accept-Language header.
+    LANGUAGE_FALLBACKS = {'zh_tw': ['zh']}
+    LANGUAGE_CACHE_SIZE = 1024
 
     def __init__(self, testing=None, uri=None):
         if uri:
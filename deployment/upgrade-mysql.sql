@@ -0,0 +1,39 @@
+-- Upgrades a MySQL database created before the catalog snapshot, conditional requests, per-language notes and
+-- keyset pagination to the current models in iqupdate/release_models.py. Run it once, with the application
+-- stopped and after a backup:
+--
+--     mysql iqupdate < deployment/upgrade-mysql.sql
+--
+-- See "Upgrading the database" in iqupdate/README.rst.
+
+-- Counts catalog changes, so every process notices a change made by another one
+CREATE TABLE catalog_generation (
+    id INTEGER NOT NULL AUTO_INCREMENT,
+    generation INTEGER NOT NULL,
+    PRIMARY KEY (id)
+);
+INSERT INTO catalog_generation (id, generation) VALUES (1, 0);
+
+-- Last change of a service pack, for the ETag and Last-Modified headers of the update views
+ALTER TABLE service_pack ADD COLUMN last_modified DATETIME;
+UPDATE service_pack SET last_modified = UTC_TIMESTAMP();
+
+-- Keyset pagination of the admin list, newest first
+CREATE INDEX ix_service_pack_release_date_id ON service_pack (release_date, id);
+
+-- Every language of Config.LANGUAGES, in the same order
+ALTER TABLE service_pack_detail
+    MODIFY language ENUM('cs','de','en','es','fr','it','hu','ko','zh_tw','zh','ja') NOT NULL;
+
+-- At most one note per service pack and language. Fails while duplicates exist, list them with
+--     SELECT service_pack_id, language, COUNT(*) FROM service_pack_detail
+--     GROUP BY service_pack_id, language HAVING COUNT(*) > 1;
+-- and delete all but one of each before running the rest of this script.
+CREATE UNIQUE INDEX ix_service_pack_detail_service_pack_id_language
+    ON service_pack_detail (service_pack_id, language);
+
+-- Deleting a service pack deletes its notes in the database too. service_pack_detail_ibfk_1 is the name MySQL
+-- gave the unnamed foreign key, check it with SHOW CREATE TABLE service_pack_detail.
+ALTER TABLE service_pack_detail DROP FOREIGN KEY service_pack_detail_ibfk_1;
+ALTER TABLE service_pack_detail ADD CONSTRAINT service_pack_detail_ibfk_1
+    FOREIGN KEY (service_pack_id) REFERENCES service_pack (id) ON DELETE CASCADE;
@@ -1,40 +1,61 @@
-import logging
-from logging.handlers import RotatingFileHandler
-import os
-from flask import Flask, request, current_app
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, current_app
 from flask_babelex import Babel
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
+from iqupdate.languages import LanguageNegotiator
+from iqupdate.log import init_logging
+from iqupdate.metrics import RequestMetrics
+from iqupdate.roles import RoleCache
+from iqupdate.routing import RoutingSQLAlchemy
+from iqupdate.slow_queries import slow_query_log
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 babel = Babel()
+languages = LanguageNegotiator()
+metrics = RequestMetrics()
+roles = RoleCache()
 
 
-def create_app(config_class=Config, debug=None, testing=None):
+def _create_base_app(config_class, testing):
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_object(config_class)
     if testing:
         app.config['TESTING'] = True
+    if app.config.get('PROXY_FIX_X_FOR'):
+        # request.remote_addr becomes the client address the trusted proxies put into X-Forwarded-For
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'], x_proto=0)
     db.init_app(app)
     babel.init_app(app)
+    languages.init_app(app)
+    metrics.init_app(app)
+    slow_query_log.init_app(app)
     if not app.debug and not app.testing:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        file_handler = RotatingFileHandler('logs/iq_update.log',
-                                           maxBytes=10240, backupCount=10)
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s '
-            '[in %(pathname)s:%(lineno)d]'))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-        app.logger.setLevel(logging.INFO)
+        init_logging(app)
         app.logger.info('IQUpdate startup')
     return app
 
 
-@babel.localeselector
-def get_locale():
-    return request.accept_languages.best_match(current_app.config['LANGUAGES'])
+def create_app(config_class=Config, debug=None, testing=None):
+    """
+    Full application, views.init_views adds the update routes, Flask-Security and the admin.
+    """
+    app = _create_base_app(config_class, testing)
+    roles.init_app(app)
+    from iqupdate import models  # noqa: F401
+    return app
 
 
-from iqupdate import models
+def create_public_app(config_class=Config, testing=None):
+    """
+    Application serving only the public update routes. Flask-Security, Flask-Admin and the user
+    models are never imported, which keeps the start-up time and memory of update workers small.
+    """
+    app = _create_base_app(config_class, testing)
+    from iqupdate.public_views import init_public_views
+    init_public_views(app)
+    return app
+
+
+@babel.localeselector
+def get_locale():
+    return languages.best_match(current_app.config['LANGUAGES'])
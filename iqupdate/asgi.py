@@ -0,0 +1,262 @@
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+from werkzeug.exceptions import HTTPException
+from iqupdate.catalog import catalog
+from iqupdate.public_views import listing_not_modified, release_event, wait_arguments
+
+# Read-only endpoints served by the ASGI application, everything else stays on the WSGI app
+PUBLIC_ENDPOINTS = ('updates_view', 'updates_json_view', 'updates_notes_view', 'service_pack_info_view')
+# Endpoints holding the connection until a release is published, awaited without a thread
+WAIT_ENDPOINTS = ('updates_wait_view', 'updates_events_view')
+# Endpoints answered from the catalog snapshot alone, run on the event loop once it is loaded unless they
+# render a template, see CatalogASGIApp._answers_on_loop
+SNAPSHOT_ENDPOINTS = ('updates_view', 'updates_json_view')
+# Body chunks of a response run on the thread pool that may wait for the client to read them
+STREAM_QUEUE_SIZE = 8
+
+
+def _environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+class CatalogASGIApp(object):
+    """
+    ASGI application serving the public update routes of a Flask app with non-blocking connection handling.
+
+    Slow clients only hold a coroutine. Requests answered from the loaded catalog snapshot are dispatched
+    on the event loop; anything that may hit the database runs on a small thread pool and its body is sent
+    chunk by chunk as the application produces it, e.g. streamed cumulative notes.
+    """
+
+    def __init__(self, flask_app, threads=4):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.get_event_loop().run_in_executor(self.executor, self.load_catalog)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def load_catalog(self):
+        with self.flask_app.app_context():
+            return catalog.snapshot()
+
+    async def _snapshot(self):
+        if self._is_loaded():
+            with self.flask_app.app_context():
+                return catalog.snapshot()
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.load_catalog)
+
+    def _is_loaded(self):
+        with self.flask_app.app_context():
+            return catalog.is_loaded()
+
+    async def _http(self, scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        environ = _environ(scope, body)
+
+        try:
+            endpoint = self.flask_app.url_map.bind_to_environ(environ).match()[0]
+        except HTTPException:
+            endpoint = None
+        if scope['method'] not in ('GET', 'HEAD') or endpoint not in PUBLIC_ENDPOINTS + WAIT_ENDPOINTS:
+            await self._send(send, '404 NOT FOUND', [('Content-Type', 'text/plain')], [b'Not Found'])
+            return
+        if endpoint in WAIT_ENDPOINTS:
+            await self._wait(endpoint, environ, receive, send)
+            return
+
+        if self._answers_on_loop(endpoint, environ):
+            status, headers, chunks = self._dispatch(environ)
+            await self._send(send, status, headers, chunks)
+        else:
+            await self._stream(environ, send)
+
+    def _answers_on_loop(self, endpoint, environ):
+        """
+        hasUpdatesFor, the JSON listing and 304s of listings the client holds. Rendering a listing stalls every
+        other connection for as long as it takes, e.g. 90 ms for 5000 service packs, it runs on the pool.
+        """
+        if endpoint not in SNAPSHOT_ENDPOINTS or not self._is_loaded():
+            return False
+        if endpoint == 'updates_json_view':
+            return True
+        try:
+            with self.flask_app.request_context(environ):
+                return bool(request.args.get('hasUpdatesFor')) or listing_not_modified(catalog.snapshot())
+        except ValueError:
+            # Bad version numbers get their error response from the pool
+            return False
+
+    async def _wait(self, endpoint, environ, receive, send):
+        config = self.flask_app.config
+        max_timeout = config['UPDATES_WAIT_TIMEOUT' if endpoint == 'updates_wait_view' else 'UPDATES_EVENTS_TIMEOUT']
+        try:
+            with self.flask_app.request_context(environ):
+                version_number, timeout = wait_arguments(max_timeout)
+        except HTTPException as error:
+            await self._send(send, '{} {}'.format(error.code, error.name), [('Content-Type', 'text/plain')],
+                             [error.name.encode('latin-1')])
+            return
+
+        if endpoint == 'updates_wait_view':
+            waiting = self._long_poll(version_number, timeout, send)
+        else:
+            waiting = self._events(version_number, timeout, config['UPDATES_EVENTS_HEARTBEAT'], send)
+        # Stop waiting as soon as the client goes away, which also drops its catalog waiter
+        tasks = [asyncio.ensure_future(waiting), asyncio.ensure_future(self._disconnected(receive))]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+
+    async def _disconnected(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _long_poll(self, version_number, timeout, send):
+        snapshot = await catalog.wait_for_update_async(version_number, timeout, self.flask_app, self._snapshot)
+        body = json.dumps(snapshot.update_status(version_number)).encode('utf-8')
+        await self._send(send, '200 OK', [('Content-Type', 'application/json'), ('Cache-Control', 'no-store')],
+                         [body])
+
+    async def _events(self, version_number, timeout, heartbeat, send):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                                (b'cache-control', b'no-store')]})
+        retry = 'retry: {}\n\n'.format(int(heartbeat * 1000))
+        await send({'type': 'http.response.body', 'body': retry.encode('utf-8'), 'more_body': True})
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            snapshot = await catalog.wait_for_update_async(version_number, min(heartbeat, remaining),
+                                                           self.flask_app, self._snapshot)
+            if snapshot.has_updates_for(version_number):
+                event = release_event(snapshot.update_status(version_number))
+                version_number = snapshot.max_version_number
+            else:
+                event = ': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def _dispatch(self, environ):
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+
+        response = self.flask_app.wsgi_app(environ, start_response)
+        try:
+            chunks = list(response)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return started['status'], started['headers'], chunks
+
+    def _produce(self, environ, loop, queue):
+        """
+        Runs on the pool: puts (status, headers) and then every body chunk of the response on queue, waiting
+        while it is full, and None at the end. The whole response is iterated on this one thread, which keeps
+        the request context of stream_with_context valid.
+        """
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        try:
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started['status'] = status
+                started['headers'] = headers
+
+            response = self.flask_app.wsgi_app(environ, start_response)
+            try:
+                put((started['status'], started['headers']))
+                for chunk in response:
+                    if chunk:
+                        put(chunk)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        finally:
+            put(None)
+
+    async def _stream(self, environ, send):
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+        producing = loop.run_in_executor(self.executor, self._produce, environ, loop, queue)
+        item = await queue.get()
+        try:
+            if item is not None:
+                await self._send_start(send, *item)
+                item = await queue.get()
+                while item is not None:
+                    await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+                    item = await queue.get()
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Sending failed, e.g. the client went away: let the producer run to its end
+            while item is not None:
+                item = await queue.get()
+        # Raises the application's exception, if any
+        await producing
+
+    async def _send_start(self, send, status, headers):
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+
+    async def _send(self, send, status, headers, chunks):
+        await self._send_start(send, status, headers)
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
@@ -0,0 +1,409 @@
+import asyncio
+import hashlib
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from iqupdate import db as database
+from iqupdate.compression import GzipPrefix
+from iqupdate.lru import LRUCache
+from iqupdate.routing import primary
+from iqupdate.release_models import ServicePack, ServicePackDetail, CatalogGeneration
+
+
+class ServicePackEntry(namedtuple('ServicePackEntry', ['id', 'description', 'version_number', 'release_date',
+                                                      'last_modified', 'languages'])):
+    __slots__ = ()
+
+    @property
+    def changed_at(self):
+        """
+        Last edit time, falling back to the release date for rows saved before it was recorded.
+        """
+        if self.last_modified:
+            return self.last_modified
+        return datetime.combine(self.release_date, datetime.min.time())
+
+
+class ReleaseNote(object):
+    """
+    Release note text together with its gzip encoding, computed once per version of the service pack.
+    """
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.gzip = GzipPrefix(contents.encode('utf-8'))
+
+
+class CatalogSnapshot(object):
+    """
+    Immutable view of the service pack catalog as it was when it was loaded.
+    Release notes are loaded on first use and kept in notes, an LRUCache shared by the snapshots of a process:
+    a note stays valid as long as its service pack's entry, whose last_modified every admin save bumps, is
+    unchanged.
+    """
+
+    def __init__(self, generation, entries, primary_until=0, notes_cache_size=0, shared_generation=0, notes=None):
+        self.generation = generation
+        # CatalogGeneration when the rows were loaded
+        self.shared_generation = shared_generation
+        self.loaded_at = time.time()
+        # Until then replicas may still lag behind the change that invalidated the previous snapshot
+        self.primary_until = primary_until
+        self.entries = tuple(sorted(entries, key=lambda entry: entry.version_number))
+        self.version_numbers = [entry.version_number for entry in self.entries]
+        self.max_version_number = self.version_numbers[-1] if self.version_numbers else None
+        self.by_version_number = dict((entry.version_number, entry) for entry in self.entries)
+        self.by_id = dict((entry.id, entry) for entry in self.entries)
+        self.by_release_date = tuple(sorted(self.entries, key=lambda entry: (entry.release_date,
+                                                                             entry.version_number)))
+        self._release_order_is_version_order = self.by_release_date == self.entries
+        # (service_pack_id, language) -> (entry, ReleaseNote or None)
+        self._notes = notes if notes is not None else LRUCache(0)
+        # (from, to, language chain) -> concatenated notes of that range, see updates_notes_view
+        self.cumulative_notes = LRUCache(notes_cache_size)
+        # Derived from the rows only, so every process holding the same catalog agrees on it
+        self.etag = hashlib.sha1(repr(self.entries).encode('utf-8')).hexdigest()
+        self.last_modified = max([entry.changed_at for entry in self.entries] or [None])
+
+    @property
+    def newest(self):
+        return self.by_release_date[-1] if self.by_release_date else None
+
+    def get(self, version_number):
+        return self.by_version_number.get(version_number)
+
+    def has_updates_for(self, version_number):
+        return self.max_version_number is not None and self.max_version_number > version_number
+
+    def update_status(self, version_number):
+        return {
+            'version': version_number,
+            'has_updates': self.has_updates_for(version_number),
+            'newest_version_number': self.max_version_number,
+        }
+
+    def newer_than(self, version_number):
+        """
+        Service packs with a version number greater than version_number, ordered by release date.
+        """
+        if self._release_order_is_version_order:
+            return self.entries[bisect_right(self.version_numbers, version_number):]
+        return tuple(entry for entry in self.by_release_date if entry.version_number > version_number)
+
+    def entries_after(self, version_number):
+        """
+        Service packs with a version number greater than version_number, ordered by version number.
+        """
+        return self.entries[bisect_right(self.version_numbers, version_number):]
+
+    def entries_between(self, from_version_number, to_version_number):
+        """
+        Service packs with from_version_number < version number <= to_version_number, ordered by version number.
+        """
+        return self.entries[bisect_right(self.version_numbers, from_version_number):
+                            bisect_right(self.version_numbers, to_version_number)]
+
+    def newer_version_numbers(self, version_number):
+        return self.version_numbers[bisect_right(self.version_numbers, version_number):]
+
+    def note(self, service_pack_id, language):
+        key = (service_pack_id, language)
+        entry = self.by_id.get(service_pack_id)
+        cached = self._notes.get(key)
+        if cached is not None and cached[0] == entry:
+            return cached[1]
+        # Single lookup on the (service_pack_id, language) index, fetching only the note text
+        query = database.session.query(ServicePackDetail.contents).filter(
+            ServicePackDetail.service_pack_id == service_pack_id,
+            ServicePackDetail.language == language)
+        if time.time() < self.primary_until:
+            with primary():
+                contents = query.scalar()
+        else:
+            contents = query.scalar()
+        note = ReleaseNote(contents) if contents is not None else None
+        self._notes.set(key, (entry, note))
+        return note
+
+    def iter_notes(self, entries, languages, batch_size=100):
+        """
+        Yield (entry, note text) for every entry with a language, languages[i] being the one of entries[i],
+        ordered by version number. All notes come from one query, read batch_size rows at a time.
+        """
+        ids_by_language = {}
+        for entry, language in zip(entries, languages):
+            if language is not None:
+                ids_by_language.setdefault(language, []).append(entry.id)
+        if not ids_by_language:
+            return
+        by_id = dict((entry.id, entry) for entry in entries)
+        query = database.session.query(ServicePackDetail.service_pack_id, ServicePackDetail.contents).join(
+            ServicePack, ServicePack.id == ServicePackDetail.service_pack_id).filter(database.or_(*[
+                database.and_(ServicePackDetail.language == language, ServicePackDetail.service_pack_id.in_(ids))
+                for language, ids in sorted(ids_by_language.items())])).order_by(ServicePack.version_number)
+        with primary() if time.time() < self.primary_until else nullcontext():
+            for service_pack_id, contents in query.yield_per(batch_size):
+                yield by_id[service_pack_id], contents
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _CatalogState(object):
+    def __init__(self, notes_size):
+        self.lock = threading.Lock()
+        # Release notes of all snapshots, see CatalogSnapshot.note
+        self.notes = LRUCache(notes_size)
+        self.generation = 0
+        self.snapshot = None
+        self.invalidated_at = 0
+        # Last time CatalogGeneration was compared with the snapshot's
+        self.checked_at = 0
+        # False once CatalogGeneration turned out to be missing, see ServicePackCatalog._generation_table_missing
+        self.generation_table = True
+        # Waiters for the next invalidation: blocked threads on the condition, asyncio futures in the set
+        self.changed = threading.Condition()
+        self.async_waiters = set()
+
+
+class ServicePackCatalog(object):
+    """
+    In-process cache of the service pack catalog shared by the public update views.
+
+    The snapshot is rebuilt lazily after invalidate() bumps the generation counter, which
+    ServicePackAdmin does whenever a service pack is saved or deleted. invalidate() also bumps the
+    CatalogGeneration row, which every process compares with its snapshot at most once per
+    CATALOG_CHECK_INTERVAL seconds, so other processes see the change after that long. Snapshots are
+    reloaded after CATALOG_CACHE_TIMEOUT seconds in any case, for rows changed outside the application.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CATALOG_CACHE_TIMEOUT', 600)
+        app.config.setdefault('CATALOG_CHECK_INTERVAL', 5)
+        app.config.setdefault('UPDATES_NOTES_CACHE_SIZE', 256)
+        app.config.setdefault('RELEASE_NOTE_CACHE_SIZE', 2048)
+        app.extensions['iqupdate_catalog'] = _CatalogState(app.config['RELEASE_NOTE_CACHE_SIZE'])
+
+    def _get_state(self, app=None):
+        return (app or current_app).extensions['iqupdate_catalog']
+
+    @property
+    def generation(self):
+        return self._get_state().generation
+
+    def invalidate(self, app=None, publish=True):
+        """
+        Drop this process' snapshot. With publish the other processes are told through CatalogGeneration,
+        which needs the change to be committed and the database not locked by the caller's transaction.
+        """
+        app = app or current_app._get_current_object()
+        state = self._get_state(app)
+        if publish and state.generation_table:
+            self._publish(app, state)
+        with state.lock:
+            state.generation += 1
+            state.snapshot = None
+            state.invalidated_at = time.time()
+        self._notify(state)
+
+    def _notify(self, state):
+        with state.changed:
+            state.changed.notify_all()
+            waiters, state.async_waiters = state.async_waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def _publish(self, app, state):
+        table = CatalogGeneration.__table__
+        bump = table.update().where(table.c.id == 1).values(generation=table.c.generation + 1)
+        engine = database.get_engine(app)
+        try:
+            with engine.begin() as connection:
+                if connection.execute(bump).rowcount == 0:
+                    connection.execute(table.insert().values(id=1, generation=1))
+        except IntegrityError:
+            # Another process inserted the row first
+            with engine.begin() as connection:
+                connection.execute(bump)
+        except (OperationalError, ProgrammingError):
+            if not self._generation_table_missing(app, state):
+                raise
+
+    def _shared_generation(self, app, state):
+        if not state.generation_table:
+            return 0
+        # Read on the primary, a replica could still return the generation before the change
+        table = CatalogGeneration.__table__
+        try:
+            return database.get_engine(app).execute(
+                select([table.c.generation]).where(table.c.id == 1)).scalar() or 0
+        except (OperationalError, ProgrammingError):
+            if not self._generation_table_missing(app, state):
+                raise
+            return 0
+
+    def _generation_table_missing(self, app, state):
+        """
+        After a failed statement on CatalogGeneration: whether the table doesn't exist, in a database not
+        upgraded yet. Catalog changes then only reach other processes after CATALOG_CACHE_TIMEOUT.
+        """
+        if database.get_engine(app).has_table(CatalogGeneration.__tablename__):
+            return False
+        state.generation_table = False
+        app.logger.warning('Table %s is missing, see "Upgrading the database" in iqupdate/README.rst. Other '
+                           'processes see catalog changes only after CATALOG_CACHE_TIMEOUT.',
+                           CatalogGeneration.__tablename__)
+        return True
+
+    def wait_for_change(self, generation, timeout, app=None):
+        """
+        Block until the catalog is invalidated after generation, or timeout seconds pass.
+        """
+        state = self._get_state(app)
+        with state.changed:
+            return state.changed.wait_for(lambda: state.generation != generation, timeout)
+
+    async def wait_for_change_async(self, generation, timeout, app):
+        state = self._get_state(app)
+        waiter = (asyncio.get_event_loop(), asyncio.get_event_loop().create_future())
+        with state.changed:
+            if state.generation != generation:
+                return True
+            state.async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with state.changed:
+                state.async_waiters.discard(waiter)
+
+    def _wait_interval(self, remaining, app):
+        # Another process' change only shows when the snapshot is checked, the first waiter to check
+        # reloads it and wakes the others
+        interval = app.config['CATALOG_CHECK_INTERVAL'] or app.config['CATALOG_CACHE_TIMEOUT']
+        return min(remaining, interval) if interval else remaining
+
+    def wait_for_update(self, version_number, timeout, app=None):
+        """
+        Block until the catalog has a version newer than version_number or timeout seconds pass.
+        All waiters share one snapshot reload per change, returns the snapshot that was current last.
+        """
+        app = app or current_app._get_current_object()
+        deadline = time.time() + timeout
+        while True:
+            snapshot = self.snapshot(app)
+            remaining = deadline - time.time()
+            if snapshot.has_updates_for(version_number) or remaining <= 0:
+                return snapshot
+            self.wait_for_change(snapshot.generation, self._wait_interval(remaining, app), app)
+
+    async def wait_for_update_async(self, version_number, timeout, app, load_snapshot):
+        """
+        Asyncio counterpart of wait_for_update, awaiting load_snapshot() whenever it needs the current snapshot.
+        """
+        deadline = time.time() + timeout
+        while True:
+            snapshot = await load_snapshot()
+            remaining = deadline - time.time()
+            if snapshot.has_updates_for(version_number) or remaining <= 0:
+                return snapshot
+            await self.wait_for_change_async(snapshot.generation, self._wait_interval(remaining, app), app)
+
+    def _is_expired(self, snapshot, app):
+        timeout = app.config['CATALOG_CACHE_TIMEOUT']
+        return snapshot is None or (timeout is not None and time.time() - snapshot.loaded_at >= timeout)
+
+    def _is_fresh(self, snapshot, state, app):
+        # Without database access, the ASGI application asks on its event loop
+        interval = app.config['CATALOG_CHECK_INTERVAL']
+        return not self._is_expired(snapshot, app) and (interval is None or time.time() - state.checked_at < interval)
+
+    def is_loaded(self, app=None):
+        app = app or current_app._get_current_object()
+        state = self._get_state(app)
+        return self._is_fresh(state.snapshot, state, app)
+
+    def snapshot(self, app=None):
+        app = app or current_app._get_current_object()
+        state = self._get_state(app)
+        snapshot = state.snapshot
+        if self._is_fresh(snapshot, state, app):
+            return snapshot
+        changed_elsewhere = False
+        with state.lock:
+            snapshot = state.snapshot
+            if self._is_fresh(snapshot, state, app):
+                return snapshot
+            if not self._is_expired(snapshot, app):
+                shared_generation = self._shared_generation(app, state)
+                state.checked_at = time.time()
+                if snapshot.shared_generation == shared_generation:
+                    return snapshot
+                # Changed by another process, the replicas may still lag behind it
+                changed_elsewhere = True
+                state.generation += 1
+                state.invalidated_at = time.time()
+            primary_until = state.invalidated_at + app.config.get('SQLALCHEMY_REPLICA_LAG', 0)
+            if time.time() < primary_until:
+                with primary():
+                    entries, shared_generation = self._load_entries(app, state)
+            else:
+                entries, shared_generation = self._load_entries(app, state)
+            if shared_generation is None:
+                shared_generation = self._shared_generation(app, state)
+            state.checked_at = time.time()
+            snapshot = CatalogSnapshot(state.generation, entries, primary_until,
+                                       app.config['UPDATES_NOTES_CACHE_SIZE'], shared_generation, state.notes)
+            state.snapshot = snapshot
+        if changed_elsewhere:
+            self._notify(state)
+        return snapshot
+
+    def _load_entries(self, app, state):
+        """
+        The catalog entries and the CatalogGeneration they belong to, None when there are no entries.
+        """
+        # One row per service pack and note language, so negotiating a note's language needs no query.
+        # The generation comes with the rows, read in the same statement.
+        columns = [ServicePack.id, ServicePack.description, ServicePack.version_number, ServicePack.release_date,
+                   ServicePack.last_modified, ServicePackDetail.language]
+        if state.generation_table:
+            columns.append(database.session.query(CatalogGeneration.generation).filter(
+                CatalogGeneration.id == 1).as_scalar().label('catalog_generation'))
+        query = database.session.query(*columns).outerjoin(
+            ServicePackDetail, ServicePackDetail.service_pack_id == ServicePack.id)
+        try:
+            rows = query.all()
+        except (OperationalError, ProgrammingError):
+            database.session.rollback()
+            if not state.generation_table or not self._generation_table_missing(app, state):
+                raise
+            return self._load_entries(app, state)
+        packs = {}
+        languages = {}
+        for row in rows:
+            packs[row.id] = row[:5]
+            if row.language:
+                languages.setdefault(row.id, []).append(row.language)
+        entries = [ServicePackEntry(*(pack + (tuple(sorted(languages.get(pack[0], ()))),)))
+                   for pack in packs.values()]
+        if not state.generation_table:
+            return entries, 0
+        return entries, (rows[0].catalog_generation or 0) if rows else None
+
+
+catalog = ServicePackCatalog()
@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+import click
+from iqupdate import db as database
+from iqupdate.catalog import catalog
+from iqupdate.models import ServicePack, ServicePackDetail
+from iqupdate.static_export import static_export
+
+
+def _read_note(note, base_dir):
+    if isinstance(note, dict):
+        with io.open(os.path.join(base_dir, note['file']), encoding='utf-8') as note_file:
+            return note_file.read()
+    return note
+
+
+def read_manifest(path):
+    """
+    Read service packs and their notes from a JSON or CSV manifest, or a directory holding manifest.json/.csv.
+
+    JSON: [{"description": "Version 7.0 0161", "release_date": "2018-11-30",
+            "notes": {"de": "<p>...</p>", "en": {"file": "0161/en.html"}}}, ...]
+    CSV: description,release_date,language and either contents or file, one row per note.
+    Note files are relative to the manifest. Returns a list of (description, release_date, {language: contents}).
+    Every row is checked before anything is written, the first invalid one raises a ClickException naming it.
+    """
+    if os.path.isdir(path):
+        for name in ('manifest.json', 'manifest.csv'):
+            if os.path.exists(os.path.join(path, name)):
+                path = os.path.join(path, name)
+                break
+        else:
+            raise click.UsageError('{} has no manifest.json or manifest.csv'.format(path))
+    base_dir = os.path.dirname(os.path.abspath(path))
+    languages = ServicePackDetail.language.type.enums
+    description_length = ServicePack.description.type.length
+    # version number -> (description, release_date, {language: contents})
+    service_packs = {}
+
+    def fail(location, message):
+        raise click.ClickException('{}, {}: {}'.format(path, location, message))
+
+    def add(location, description, release_date, notes, merge):
+        try:
+            version_number = int(description.split(' ')[-1])
+        except (AttributeError, ValueError):
+            fail(location, 'description {!r} does not end with a version number'.format(description))
+        if len(description) > description_length:
+            fail(location, 'description {!r} is longer than {} characters'.format(description, description_length))
+        try:
+            release_date = datetime.strptime(release_date, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            fail(location, 'release_date {!r} is not a YYYY-MM-DD date'.format(release_date))
+        service_pack = service_packs.get(version_number)
+        if service_pack is None:
+            service_pack = service_packs[version_number] = (description, release_date, {})
+        elif not merge or service_pack[:2] != (description, release_date):
+            fail(location, 'version {} is listed twice'.format(version_number))
+        for language, note in notes:
+            if language not in languages:
+                fail(location, 'unknown language {!r}, expected one of {}'.format(language, ', '.join(languages)))
+            if language in service_pack[2]:
+                fail(location, 'version {} has two {} notes'.format(version_number, language))
+            try:
+                service_pack[2][language] = _read_note(note, base_dir)
+            except (KeyError, TypeError, IOError) as error:
+                fail(location, 'cannot read the {} note: {}'.format(language, error))
+
+    with io.open(path, encoding='utf-8', newline='') as manifest:
+        if path.endswith('.csv'):
+            reader = csv.DictReader(manifest)
+            for row in reader:
+                note = row['contents'] if row.get('contents') else {'file': row.get('file')}
+                add('line {}'.format(reader.line_num), row.get('description'), row.get('release_date'),
+                    [(row.get('language'), note)], True)
+        else:
+            try:
+                entries = json.load(manifest)
+            except ValueError as error:
+                raise click.ClickException('{} is not valid JSON: {}'.format(path, error))
+            for number, entry in enumerate(entries, 1):
+                location = 'entry {}'.format(number)
+                if not isinstance(entry, dict) or not isinstance(entry.get('notes', {}), dict):
+                    fail(location, 'expected an object with a "notes" object')
+                add(location, entry.get('description'), entry.get('release_date'),
+                    sorted(entry.get('notes', {}).items()), False)
+    return list(service_packs.values())
+
+
+def _batches(rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def import_service_packs(service_packs, batch_size=1000):
+    """
+    Insert service packs and their notes with batched multi-row inserts in the current transaction.
+    Returns the number of service packs and notes inserted.
+    """
+    rows = [{'description': description, 'version_number': int(description.split(' ')[-1]),
+             'release_date': release_date} for description, release_date, notes in service_packs]
+    version_numbers = [row['version_number'] for row in rows]
+    existing = []
+    for batch in _batches(version_numbers, batch_size):
+        existing.extend(version_number for version_number, in database.session.query(
+            ServicePack.version_number).filter(ServicePack.version_number.in_(batch)))
+    if existing:
+        raise click.ClickException('Service packs already exist: {}'.format(
+            ', '.join(str(version_number) for version_number in sorted(existing))))
+
+    for batch in _batches(rows, batch_size):
+        database.session.execute(ServicePack.__table__.insert(), batch)
+    ids = {}
+    for batch in _batches(version_numbers, batch_size):
+        ids.update(database.session.query(ServicePack.version_number, ServicePack.id).filter(
+            ServicePack.version_number.in_(batch)))
+    details = [{'service_pack_id': ids[row['version_number']], 'language': language, 'contents': contents}
+               for row, (description, release_date, notes) in zip(rows, service_packs)
+               for language, contents in sorted(notes.items())]
+    for batch in _batches(details, batch_size):
+        database.session.execute(ServicePackDetail.__table__.insert(), batch)
+    return len(rows), len(details)
+
+
+def init_commands(application):
+    @application.cli.command('import-release-notes')
+    @click.argument('manifest', type=click.Path(exists=True))
+    @click.option('--batch-size', default=1000, show_default=True, help='Rows per INSERT statement.')
+    @click.option('--dry-run', is_flag=True, help='Import and roll back, nothing is stored.')
+    def import_release_notes_command(manifest, batch_size, dry_run):
+        """Import service packs and release notes from a JSON/CSV manifest or a directory holding one."""
+        started = time.time()
+        service_packs = read_manifest(manifest)
+        try:
+            packs, notes = import_service_packs(service_packs, batch_size)
+        except Exception:
+            database.session.rollback()
+            raise
+        if dry_run:
+            database.session.rollback()
+        else:
+            database.session.commit()
+            catalog.invalidate()
+            if static_export.is_enabled():
+                static_export.export()
+        elapsed = time.time() - started
+        click.echo('{} {} service packs and {} notes in {:.2f}s ({:.0f} notes/s)'.format(
+            'Checked' if dry_run else 'Imported', packs, notes, elapsed, notes / elapsed if elapsed else 0))
+
+    @application.cli.command('export-static')
+    def export_static_command():
+        """Write the public update data as static files into STATIC_EXPORT_DIR."""
+        if not static_export.is_enabled():
+            raise click.UsageError('Set STATIC_EXPORT_DIR to export the catalog')
+        started = time.time()
+        tree = static_export.export()
+        click.echo('Exported the catalog to {} in {:.2f}s'.format(tree, time.time() - started))
+
+    return application
@@ -0,0 +1,26 @@
+import struct
+import zlib
+
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+class GzipPrefix(object):
+    """
+    Text compressed once, to which a short per-request suffix can be appended as gzip.
+
+    The text is kept as a raw deflate stream ending in a full flush, so the suffix can be
+    compressed on its own and spliced after it into one valid gzip member.
+    """
+
+    def __init__(self, data):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.deflated = compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+        self.crc = zlib.crc32(data)
+        self.size = len(data)
+
+    def gzip(self, suffix=b''):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        tail = compressor.compress(suffix) + compressor.flush()
+        trailer = struct.pack('<II', zlib.crc32(suffix, self.crc) & 0xffffffff,
+                              (self.size + len(suffix)) & 0xffffffff)
+        return GZIP_HEADER + self.deflated + tail + trailer
@@ -1,18 +1,94 @@
-from flask import url_for, redirect, request, abort
+from datetime import datetime
+from flask import url_for, redirect, request, abort, g, jsonify, flash, current_app
+from flask_principal import RoleNeed, UserNeed
 from flask_security import current_user
+from flask_security.confirmable import requires_confirmation
+from flask_security.forms import LoginForm
+from flask_security.utils import _datastore, _security, config_value, get_hmac, get_message, use_double_hash
+from flask_admin import BaseView, expose
+from flask_admin.actions import action
+from flask_admin.babel import gettext, ngettext, lazy_gettext
 from flask_admin.contrib import sqla
-from iqupdate import db as database
+from flask_admin.contrib.sqla.fields import InlineModelFormList
+from flask_admin.contrib.sqla.form import InlineModelConverter
+from flask_admin.form import RenderTemplateWidget
+from flask_admin.model.form import InlineFormAdmin
+from sqlalchemy import and_, or_
+from wtforms import TextAreaField, ValidationError
+from iqupdate import db as database, roles
+from iqupdate.catalog import catalog
+from iqupdate.passwords import password_verifier
+from iqupdate.slow_queries import slow_query_log
+from iqupdate.static_export import static_export
 from iqupdate.models import ServicePack, ServicePackDetail
 
 
-# Create customized model view class
-class MyModelView(sqla.ModelView):
+def load_identity(sender, identity):
+    """
+    identity_loaded receiver taking the role needs from the role cache, replaces Flask-Security's which
+    loads current_user.roles on every request.
+    """
+    if hasattr(current_user, 'id'):
+        identity.provides.add(UserNeed(current_user.id))
+    for name in roles.roles(current_user):
+        identity.provides.add(RoleNeed(name))
+    identity.user = current_user
+
+
+class PooledLoginForm(LoginForm):
+    """
+    Flask-Security's login form with the password hash checked on the password verifier's pool.
+    Hashes using a deprecated scheme or a lower cost than SECURITY_PASSWORD_HASH_OPTIONS are replaced.
+    """
+
+    def validate(self):
+        if not super(LoginForm, self).validate():
+            return False
+
+        self.user = _datastore.get_user(self.email.data)
+
+        if self.user is None:
+            self.email.errors.append(get_message('USER_DOES_NOT_EXIST')[0])
+            return False
+        if not self.user.password:
+            self.password.errors.append(get_message('PASSWORD_NOT_SET')[0])
+            return False
+        if not self._verify_password():
+            self.password.errors.append(get_message('INVALID_PASSWORD')[0])
+            return False
+        if requires_confirmation(self.user):
+            self.email.errors.append(get_message('CONFIRMATION_REQUIRED')[0])
+            return False
+        if not self.user.is_active:
+            self.email.errors.append(get_message('DISABLED_ACCOUNT')[0])
+            return False
+        return True
+
+    def _verify_password(self):
+        # Everything reading the app config or the database stays on the request thread
+        password = self.password.data
+        password_hash = self.user.password
+        candidate = get_hmac(password) if use_double_hash(password_hash) else password
+        new_password = get_hmac(password).decode('ascii') if use_double_hash() else password
+        options = config_value('PASSWORD_HASH_OPTIONS', default={}).get(_security.password_hash, {})
+        verified, new_hash = password_verifier.verify(_security.pwd_context, candidate, password_hash,
+                                                      new_password, options)
+        if new_hash is not None:
+            self.user.password = new_hash
+            _datastore.put(self.user)
+        return verified
+
+
+class SuperuserAccess(object):
+    """
+    Admin views only superusers may open, others are sent to the login page or get 403.
+    """
 
     def is_accessible(self):
         if not current_user.is_active or not current_user.is_authenticated:
             return False
 
-        if current_user.has_role('superuser'):
+        if roles.has_role(current_user, 'superuser'):
             return True
 
         return False
@@ -30,24 +106,62 @@ class MyModelView(sqla.ModelView):
                 return redirect(url_for('security.login', next=request.url))
 
 
+# Create customized model view class
+class MyModelView(SuperuserAccess, sqla.ModelView):
+
+    def after_model_change(self, form, model, is_created):
+        roles.invalidate()
+
+    def after_model_delete(self, model):
+        roles.invalidate()
+
+
 # Inline form for ServicePack and ServicePackDetail
+def _contents_required_for_new_detail(form, field):
+    if not form.id.data and not field.data:
+        raise ValidationError('This field is required.')
+
+
+class DeferredContentsField(TextAreaField):
+    """
+    Text area for the deferred ServicePackDetail.contents. It is not filled from the detail, so the edit view
+    doesn't load the notes; the contents are written back only when they were shown or typed in.
+    """
+
+    def populate_obj(self, obj, name):
+        if self.data:
+            obj.contents = self.data
+
+
+class DetailFormList(InlineModelFormList):
+    widget = RenderTemplateWidget('field_list.html')
+
+
+class DetailFormConverter(InlineModelConverter):
+    inline_field_list_type = DetailFormList
+
+
 inline_form_options = {
     'form_label': "Details",
-    'form_columns': ['id', 'language', 'contents'],
+    'form_columns': ['id', 'language', 'note'],
     'form_args': None,
-    'form_extra_fields': None,
+    'form_extra_fields': {
+        'note': DeferredContentsField('Contents', validators=[_contents_required_for_new_detail]),
+    },
 }
 
 
 # ServicePackAdmin model
 class ServicePackAdmin(MyModelView):
     form_excluded_columns = ('version_number',)
-    inline_models = [(ServicePackDetail, inline_form_options), ]
+    inline_models = [InlineFormAdmin(ServicePackDetail, **inline_form_options), ]
+    inline_model_form_converter = DetailFormConverter
     column_list = [
         'description',
         'release_date',
     ]
     column_default_sort = ('release_date', True)
+    list_template = 'admin/service_pack_list.html'
 
     def __init__(self):
         super(ServicePackAdmin, self).__init__(ServicePack, database.session, name='ServicePacks')
@@ -56,18 +170,133 @@ class ServicePackAdmin(MyModelView):
         if not current_user.is_active or not current_user.is_authenticated:
             return False
 
-        if current_user.has_role('releaseuser'):
+        if roles.has_role(current_user, 'releaseuser'):
             return True
 
         return False
 
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        """
+        Keyset pagination for the default newest-first order: the page after ?after=<release_date>.<id> is read
+        from the index on (release_date, id) instead of skipping rows with OFFSET. Other sort orders, searches and
+        filters keep Flask-Admin's numbered pages.
+        """
+        view_args = self._get_list_extra_args()
+        after = view_args.extra_args.get('after')
+        if sort_column is not None or search or filters or page or not execute:
+            return super(ServicePackAdmin, self).get_list(page, sort_column, sort_desc, search, filters,
+                                                          execute, page_size)
+
+        query = self.get_query().order_by(ServicePack.release_date.desc(), ServicePack.id.desc())
+        if after:
+            try:
+                release_date, service_pack_id = after.split('.')
+                release_date = datetime.strptime(release_date, '%Y-%m-%d').date()
+                service_pack_id = int(service_pack_id)
+            except ValueError:
+                abort(400)
+            query = query.filter(or_(ServicePack.release_date < release_date,
+                                     and_(ServicePack.release_date == release_date,
+                                          ServicePack.id < service_pack_id)))
+        if page_size:
+            query = query.limit(page_size)
+        service_packs = query.all()
+
+        extra_args = dict((key, value) for key, value in view_args.extra_args.items() if key != 'after')
+        older = None
+        if page_size and len(service_packs) == page_size:
+            last = service_packs[-1]
+            older = self._get_list_url(view_args.clone(extra_args=dict(
+                extra_args, after='{}.{}'.format(last.release_date.isoformat(), last.id))))
+        # The list template renders its Newest/Older pager from this instead of page numbers
+        g.iqupdate_keyset = {
+            'newest': self._get_list_url(view_args.clone(extra_args=extra_args)) if after else None,
+            'older': older,
+        }
+        return self.get_count_query().scalar(), service_packs
+
+    @expose('/details/<int:detail_id>/contents')
+    def detail_contents_view(self, detail_id):
+        detail = ServicePackDetail.query.get_or_404(detail_id)
+        return jsonify(id=detail.id, language=detail.language, contents=detail.contents)
+
     def on_model_change(self, form, service_pack, is_created):
         description = service_pack.description
         service_pack.version_number = int(description.split(' ')[-1])
+        # Inline detail changes don't touch the service pack row, but they change its notes
+        service_pack.last_modified = datetime.utcnow()
+        # Not committed yet, the other processes are told in after_model_change
+        catalog.invalidate(publish=False)
 
         return service_pack
 
+    def after_model_change(self, form, service_pack, is_created):
+        # Invalidate again once committed, a snapshot loaded in between still holds the old rows
+        catalog.invalidate()
+        # Compress the saved notes now rather than on the first client request
+        snapshot = catalog.snapshot()
+        for detail in service_pack.details:
+            snapshot.note(service_pack.id, detail.language)
+        self._export([service_pack.id])
+
     def on_model_delete(self, service_pack):
-        ServicePackDetail.query.filter_by(service_pack_id=service_pack.id).delete()
-        database.session.commit()
+        # The details go with the service pack through the relationship cascade, in the same transaction
+        catalog.invalidate(publish=False)
         return service_pack
+
+    def after_model_delete(self, service_pack):
+        catalog.invalidate()
+        self._export([])
+
+    def _export(self, service_pack_ids):
+        # Only the files the changed service packs affect are written again, see StaticExporter.export
+        if not static_export.is_enabled():
+            return
+        try:
+            static_export.export(service_pack_ids)
+        except Exception:
+            # The change is saved, the static tree stays at the previous state until the next export
+            current_app.logger.exception('Static export failed')
+            flash(gettext('The static export failed, it still serves the previous catalog.'), 'error')
+
+    @action('delete',
+            lazy_gettext('Delete'),
+            lazy_gettext('Are you sure you want to delete selected records?'))
+    def action_delete(self, ids):
+        """
+        Delete the selected service packs and their details with one DELETE per table in one transaction,
+        instead of loading and deleting them row by row.
+        """
+        if not self.can_delete:
+            flash(gettext('You are not allowed to delete records.'), 'error')
+            return
+        try:
+            ids = [int(service_pack_id) for service_pack_id in ids]
+            ServicePackDetail.query.filter(ServicePackDetail.service_pack_id.in_(ids)).delete(
+                synchronize_session=False)
+            count = ServicePack.query.filter(ServicePack.id.in_(ids)).delete(synchronize_session=False)
+            self.session.commit()
+            catalog.invalidate()
+            self._export([])
+
+            flash(ngettext('Record was successfully deleted.',
+                           '%(count)s records were successfully deleted.',
+                           count,
+                           count=count), 'success')
+        except Exception as ex:
+            self.session.rollback()
+            if not self.handle_view_exception(ex):
+                raise
+
+            flash(gettext('Failed to delete records. %(error)s', error=str(ex)), 'error')
+
+
+class SlowQueryView(SuperuserAccess, BaseView):
+    """
+    Statements this process found slow, aggregated by shape, see iqupdate/slow_queries.py.
+    """
+
+    @expose('/')
+    def index(self):
+        return self.render('admin/slow_queries.html', statements=slow_query_log.statements(),
+                           threshold=current_app.config['SLOW_QUERY_THRESHOLD'])
@@ -0,0 +1,54 @@
+"""
+Production gunicorn settings, for the full or the public application:
+
+    gunicorn -c python:iqupdate.gunicorn_config iqupdate.iq_update:application
+    gunicorn -c python:iqupdate.gunicorn_config iqupdate.iq_update_public:application
+
+The application is loaded once in the master and forked into the workers. Every worker warms up, see
+iqupdate/warmup.py, before it accepts its first request. The GUNICORN_* environment variables override
+the defaults below.
+"""
+import multiprocessing
+import os
+
+_cpus = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+# Requests mostly wait for the database, two threads per worker and two workers per CPU keep the CPUs busy
+workers = int(os.environ.get('GUNICORN_WORKERS', _cpus * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+worker_class = 'gthread'
+
+preload_app = True
+# Recycle workers now and then so a slow leak can't grow without bound; the jitter keeps them from all
+# restarting at once. Running requests finish first, for up to graceful_timeout seconds.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+graceful_timeout = 30
+timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+
+
+def _application(server):
+    return server.app.wsgi()
+
+
+def when_ready(server):
+    # Compiled templates and message catalogs are shared with the workers through fork
+    from iqupdate.warmup import warm_up
+    warm_up(_application(server), steps=('templates', 'translations'))
+
+
+def pre_fork(server, worker):
+    # Disposed in the master before forking, closing them in a worker would close the master's sockets too
+    from iqupdate.warmup import dispose_engines
+    dispose_engines(_application(server))
+
+
+def post_worker_init(worker):
+    # Each worker holds its own connections and catalog snapshot
+    from iqupdate.warmup import warm_up
+    warm_up(worker.wsgi, connections=worker.cfg.threads, steps=('connections', 'catalog'))
@@ -1,10 +1,11 @@
-from iqupdate import create_app, views
+from iqupdate import create_app, views, commands
 from config import Config
 
 application = create_app(Config)
 
 views.init_views(application)
+commands.init_commands(application)
 
 if __name__ == '__main__':
-    # Start application
+    # Start the development server, production runs gunicorn with iqupdate/gunicorn_config.py
     application.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,9 @@
+from iqupdate import create_public_app
+from iqupdate.asgi import CatalogASGIApp
+from config import Config
+
+# Public update routes only, run with e.g. `uvicorn iqupdate.iq_update_asgi:application`.
+# The admin UI keeps running on the WSGI application in iq_update.py.
+flask_application = create_public_app(Config)
+
+application = CatalogASGIApp(flask_application, threads=flask_application.config['ASGI_THREADS'])
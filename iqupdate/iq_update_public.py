@@ -0,0 +1,10 @@
+from iqupdate import create_public_app
+from config import Config
+
+# Public update routes only, for update workers, e.g. `gunicorn iqupdate.iq_update_public:application`.
+# The admin UI runs on the full application in iq_update.py.
+application = create_public_app(Config)
+
+if __name__ == '__main__':
+    # Start application
+    application.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,78 @@
+from flask import current_app, request
+from werkzeug.datastructures import LanguageAccept
+from werkzeug.http import parse_accept_header
+from iqupdate.lru import LRUCache
+
+
+def normalize(language):
+    """
+    'zh-TW' and 'zh_TW' both become 'zh_tw', the spelling of Config.LANGUAGES and the translation folders.
+    """
+    return language.strip().lower().replace('-', '_')
+
+
+class LanguageNegotiator(object):
+    """
+    Picks the language of a response from the Accept-Language header or an explicit language.
+
+    Every requested language expands into a fallback chain: the language, its LANGUAGE_FALLBACKS,
+    its primary subtag and finally BABEL_DEFAULT_LOCALE, e.g. de-AT -> de -> en. Chains are
+    cached per raw Accept-Language header in an LRU of LANGUAGE_CACHE_SIZE entries.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LANGUAGE_FALLBACKS', {})
+        app.config.setdefault('LANGUAGE_CACHE_SIZE', 1024)
+        app.extensions['iqupdate_languages'] = LRUCache(app.config['LANGUAGE_CACHE_SIZE'])
+
+    def _chain(self, languages, config):
+        chain = []
+        for language in languages:
+            language = normalize(language)
+            if language == '*':
+                continue
+            fallbacks = [language] + list(config['LANGUAGE_FALLBACKS'].get(language, ()))
+            if '_' in language:
+                primary_language = language.split('_')[0]
+                fallbacks += [primary_language] + list(config['LANGUAGE_FALLBACKS'].get(primary_language, ()))
+            chain.extend(fallback for fallback in fallbacks if fallback not in chain)
+        default = normalize(config['BABEL_DEFAULT_LOCALE'])
+        if default not in chain:
+            chain.append(default)
+        return tuple(chain)
+
+    def preferences(self, header):
+        """
+        Fallback chain of a raw Accept-Language header, most preferred first.
+        """
+        cache = current_app.extensions['iqupdate_languages']
+        chain = cache.get(header)
+        if chain is None:
+            accepted = parse_accept_header(header, LanguageAccept)
+            chain = self._chain([language for language, quality in accepted if quality > 0], current_app.config)
+            cache.set(header, chain)
+        return chain
+
+    def chain(self, language=None):
+        """
+        Fallback chain of language, or of the request's Accept-Language header.
+        """
+        if language:
+            return self._chain([language], current_app.config)
+        return self.preferences(request.headers.get('Accept-Language', ''))
+
+    def best_match(self, available, language=None):
+        """
+        First language of the fallback chain of language, or of the request's Accept-Language header,
+        that is in available. Returns None when none is.
+        """
+        chain = self.chain(language)
+        available = dict((normalize(candidate), candidate) for candidate in available)
+        for candidate in chain:
+            if candidate in available:
+                return available[candidate]
+        return None
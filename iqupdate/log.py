@@ -0,0 +1,235 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+from flask import g, request
+
+ACCESS_LOGGER = 'iqupdate.access'
+
+# logger name -> handlers init_logging added to it
+_installed = {}
+
+
+class BatchedWatchedFileHandler(WatchedFileHandler):
+    """
+    WatchedFileHandler that writes a batch of records at once and checks once per batch whether the file was
+    rotated. All workers append to the same file, one write per batch keeps their records from interleaving.
+    """
+
+    def __init__(self, filename):
+        WatchedFileHandler.__init__(self, filename)
+        self.batch = []
+
+    def emit(self, record):
+        try:
+            self.batch.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+    def flush_batch(self):
+        self.acquire()
+        try:
+            if self.batch:
+                if self.stream is None:
+                    self.stream = self._open()
+                self.reopenIfNeeded()
+                self.stream.write(''.join(self.batch))
+                self.stream.flush()
+                self.batch = []
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush_batch()
+        WatchedFileHandler.close(self)
+
+
+class _DropQueueHandler(QueueHandler):
+    """
+    QueueHandler that drops records while the queue is full rather than blocking the request thread.
+    """
+
+    def __init__(self, log_queue):
+        QueueHandler.__init__(self, log_queue)
+        self.dropped_lock = threading.Lock()
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def take_dropped(self):
+        with self.dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    def start_listener(self, handlers, batch_size):
+        self.listener = _BatchingQueueListener(self.queue, handlers, batch_size, self)
+        self.listener.start()
+
+    def restart_listener(self):
+        """
+        Start a listener on a new queue in a forked child, the listener thread only exists in the parent.
+        The records queued at the fork are written by the parent, the child's copy of them is dropped.
+        """
+        listener = self.listener
+        self.queue = queue.Queue(listener.queue.maxsize)
+        self.dropped_lock = threading.Lock()
+        self.dropped = 0
+        self.start_listener(listener.handlers, listener.batch_size)
+
+
+class _BatchingQueueListener(QueueListener):
+    """
+    QueueListener handling up to batch_size queued records at a time and flushing its handlers once per batch.
+    """
+
+    def __init__(self, log_queue, handlers, batch_size, queue_handler):
+        QueueListener.__init__(self, log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.queue_handler = queue_handler
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            QueueListener.stop(self)
+        for handler in self.handlers:
+            handler.close()
+
+    def _monitor(self):
+        while True:
+            records = [self.dequeue(True)]
+            try:
+                while len(records) < self.batch_size:
+                    records.append(self.dequeue(False))
+            except queue.Empty:
+                pass
+            dropped = self.queue_handler.take_dropped()
+            if dropped:
+                self.handle(logging.makeLogRecord({
+                    'name': 'iqupdate', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': '{} log records dropped, the queue was full'.format(dropped)}))
+            for record in records:
+                if record is not self._sentinel:
+                    self.handle(record)
+            for handler in self.handlers:
+                getattr(handler, 'flush_batch', handler.flush)()
+            for _ in records:
+                self.queue.task_done()
+            if self._sentinel in records:
+                return
+
+
+def _restart_listeners():
+    # e.g. in the gunicorn workers of an application preloaded in the master, see gunicorn_config.py
+    for handlers in _installed.values():
+        for handler in handlers:
+            if isinstance(handler, _DropQueueHandler):
+                handler.restart_listener()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listeners)
+
+
+def _stop_listener(queue_handler):
+    # The listener of this process, a forked child replaced the one of its parent
+    queue_handler.listener.stop()
+
+
+class _ExcludeFilter(logging.Filter):
+    def filter(self, record):
+        return not logging.Filter.filter(self, record)
+
+
+def _access_log(response):
+    started = g.pop('iqupdate_log_started', None)
+    if started is None:
+        return response
+    logging.getLogger(ACCESS_LOGGER).info(json.dumps({
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'remote_addr': request.remote_addr,
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'bytes': response.calculate_content_length(),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+    }, sort_keys=True))
+    return response
+
+
+def init_logging(app):
+    """
+    Log to LOG_DIR/iq_update.log, and with LOG_ACCESS_JSON one JSON line per request to LOG_DIR/access.log.
+    Every worker appends to both, they are rotated by logrotate (deployment/logrotate.conf) and reopened
+    when moved. With LOG_QUEUE request threads only enqueue records and a listener thread
+    writes them in batches of up to LOG_BATCH_SIZE; records arriving while LOG_QUEUE_SIZE are waiting are
+    dropped and counted. Forked children, e.g. gunicorn workers with preload_app, start listeners of their own.
+    """
+    config = app.config
+    config.setdefault('LOG_DIR', 'logs')
+    config.setdefault('LOG_QUEUE', True)
+    config.setdefault('LOG_QUEUE_SIZE', 10000)
+    config.setdefault('LOG_BATCH_SIZE', 100)
+    config.setdefault('LOG_ACCESS_JSON', False)
+    if not os.path.exists(config['LOG_DIR']):
+        os.makedirs(config['LOG_DIR'])
+
+    def file_handler(name):
+        handler_class = BatchedWatchedFileHandler if config['LOG_QUEUE'] else WatchedFileHandler
+        return handler_class(os.path.join(config['LOG_DIR'], name))
+
+    app_handler = file_handler('iq_update.log')
+    app_handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(levelname)s: %(message)s '
+        '[in %(pathname)s:%(lineno)d]'))
+    app_handler.setLevel(logging.INFO)
+    handlers = [app_handler]
+    if config['LOG_ACCESS_JSON']:
+        app_handler.addFilter(_ExcludeFilter(ACCESS_LOGGER))
+        access_handler = file_handler('access.log')
+        access_handler.setFormatter(logging.Formatter('%(message)s'))
+        access_handler.addFilter(logging.Filter(ACCESS_LOGGER))
+        handlers.append(access_handler)
+
+        @app.before_request
+        def start_access_log():
+            g.iqupdate_log_started = time.perf_counter()
+
+        app.after_request(_access_log)
+
+    # app.logger is shared by every app of the process, replace what an earlier init_logging installed
+    stop_logging(app)
+    if config['LOG_QUEUE']:
+        log_queue = queue.Queue(config['LOG_QUEUE_SIZE'])
+        queue_handler = _DropQueueHandler(log_queue)
+        queue_handler.start_listener(handlers, config['LOG_BATCH_SIZE'])
+        # Write out what is still queued when the process exits
+        atexit.register(_stop_listener, queue_handler)
+        handlers = [queue_handler]
+    for handler in handlers:
+        app.logger.addHandler(handler)
+    _installed[app.logger.name] = handlers
+    app.logger.setLevel(logging.INFO)
+    return app
+
+
+def stop_logging(app):
+    """
+    Remove the handlers init_logging added, after writing out the queued records.
+    """
+    for handler in _installed.pop(app.logger.name, ()):
+        app.logger.removeHandler(handler)
+        if isinstance(handler, _DropQueueHandler):
+            handler.listener.stop()
+        handler.close()
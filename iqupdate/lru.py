@@ -0,0 +1,29 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping keeping the size most recently used items.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return None
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import defaultdict
+from flask import g, request, abort, current_app, has_request_context, before_render_template, template_rendered
+from iqupdate import sql_timing
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class _Registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: _Histogram(LATENCY_BUCKETS))
+        self.responses = defaultdict(int)
+        self.sql_statements = defaultdict(int)
+        self.sql_seconds = defaultdict(float)
+        self.template_seconds = defaultdict(float)
+
+
+class _RequestTimings(object):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_started = []
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in sorted(labels.items())) + '}'
+
+
+def _current_timings():
+    if has_request_context():
+        return g.get('_iqupdate_timings')
+    return None
+
+
+def _record_statement(conn, cursor, statement, parameters, executemany, duration):
+    timings = _current_timings()
+    if timings is not None:
+        timings.sql_statements += 1
+        timings.sql_seconds += duration
+
+
+def _before_render_template(app, template, context, **extra):
+    timings = _current_timings()
+    if timings is not None:
+        timings.template_started.append(time.perf_counter())
+
+
+def _template_rendered(app, template, context, **extra):
+    timings = _current_timings()
+    if timings is not None and timings.template_started:
+        timings.template_seconds += time.perf_counter() - timings.template_started.pop()
+
+
+class RequestMetrics(object):
+    """
+    Per-endpoint request latency, SQL and template render time, exposed in Prometheus text format on /metrics.
+
+    /metrics answers requests from the addresses in METRICS_ALLOWED_ADDRESSES, none by default, and from
+    superusers when METRICS_ALLOW_SUPERUSER is set. Behind a reverse proxy every request comes from the proxy's
+    address, set PROXY_FIX_X_FOR so the client address is checked instead.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_ALLOW_SUPERUSER', True)
+        app.config.setdefault('METRICS_ALLOWED_ADDRESSES', [])
+        if not app.config['METRICS_ENABLED']:
+            return
+        app.extensions['iqupdate_metrics'] = _Registry()
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(_before_render_template, app)
+        template_rendered.connect(_template_rendered, app)
+        sql_timing.on_statement(_record_statement)
+        app.add_url_rule('/metrics', 'metrics_view', self.metrics_view)
+
+    def _start_request(self):
+        g._iqupdate_timings = _RequestTimings()
+
+    def _finish_request(self, response):
+        timings = g.pop('_iqupdate_timings', None)
+        if timings is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        registry = current_app.extensions['iqupdate_metrics']
+        with registry.lock:
+            registry.latency[endpoint].observe(time.perf_counter() - timings.started)
+            registry.responses[(endpoint, response.status_code)] += 1
+            registry.sql_statements[endpoint] += timings.sql_statements
+            registry.sql_seconds[endpoint] += timings.sql_seconds
+            registry.template_seconds[endpoint] += timings.template_seconds
+        return response
+
+    def _is_allowed(self):
+        if request.remote_addr in current_app.config['METRICS_ALLOWED_ADDRESSES']:
+            return True
+        # The public application has no logins, only the full one lets superusers in
+        if not current_app.config['METRICS_ALLOW_SUPERUSER'] or 'security' not in current_app.extensions:
+            return False
+        from flask_security import current_user
+        from iqupdate import roles
+        return current_user.is_active and roles.has_role(current_user, 'superuser')
+
+    def metrics_view(self):
+        if not self._is_allowed():
+            abort(403)
+        response = current_app.response_class(self.render(), mimetype='text/plain')
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return response
+
+    def render(self):
+        registry = current_app.extensions['iqupdate_metrics']
+        lines = []
+        with registry.lock:
+            lines.append('# HELP iqupdate_request_duration_seconds Request latency by endpoint.')
+            lines.append('# TYPE iqupdate_request_duration_seconds histogram')
+            for endpoint, histogram in sorted(registry.latency.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append('iqupdate_request_duration_seconds_bucket{} {}'.format(
+                        _labels(endpoint=endpoint, le=repr(bound)), count))
+                lines.append('iqupdate_request_duration_seconds_bucket{} {}'.format(
+                    _labels(endpoint=endpoint, le='+Inf'), histogram.count))
+                lines.append('iqupdate_request_duration_seconds_sum{} {!r}'.format(
+                    _labels(endpoint=endpoint), histogram.sum))
+                lines.append('iqupdate_request_duration_seconds_count{} {}'.format(
+                    _labels(endpoint=endpoint), histogram.count))
+            lines.append('# HELP iqupdate_responses_total Responses by endpoint and status code.')
+            lines.append('# TYPE iqupdate_responses_total counter')
+            for (endpoint, status), count in sorted(registry.responses.items()):
+                lines.append('iqupdate_responses_total{} {}'.format(_labels(endpoint=endpoint, status=status),
+                                                                   count))
+            for name, help_text, values in (
+                    ('iqupdate_sql_statements_total', 'SQL statements executed by endpoint.',
+                     registry.sql_statements),
+                    ('iqupdate_sql_seconds_total', 'Time spent executing SQL by endpoint.', registry.sql_seconds),
+                    ('iqupdate_template_render_seconds_total', 'Time spent rendering templates by endpoint.',
+                     registry.template_seconds)):
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} counter'.format(name))
+                for endpoint, value in sorted(values.items()):
+                    lines.append('{}{} {!r}'.format(name, _labels(endpoint=endpoint), value))
+        return '\n'.join(lines) + '\n'
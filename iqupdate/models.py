@@ -1,5 +1,7 @@
 from flask_security import UserMixin, RoleMixin
 from iqupdate import db as database
+# The service pack models live apart so the public application can load them without Flask-Security
+from iqupdate.release_models import ServicePack, ServicePackDetail, CatalogGeneration  # noqa: F401
 
 # Define models
 roles_users = database.Table(
@@ -30,27 +32,3 @@ class User(database.Model, UserMixin):
 
     def __str__(self):
         return self.email
-
-
-class ServicePack(database.Model):
-    id = database.Column(database.Integer(), primary_key=True)
-    description = database.Column(database.String(20), unique=True, nullable=False)
-    version_number = database.Column(database.Integer(), unique=True, nullable=False)
-    release_date = database.Column(database.Date(), nullable=False)
-
-    def __str__(self):
-        return "{} - {}".format(self.description, self.release_date)
-
-
-class ServicePackDetail(database.Model):
-    id = database.Column(database.Integer(), primary_key=True)
-    language = database.Column(database.Enum('de', 'en'), nullable=False)
-    contents = database.Column(database.Text, nullable=False)
-    service_pack_id = database.Column(database.Integer, database.ForeignKey(ServicePack.id), nullable=False)
-    service_pack = database.relation(ServicePack, backref='details')
-
-    def __str__(self):
-        return "{} - {}".format(self.language, self.contents)
-
-    def __repr__(self):
-        return self.__str__
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app, request, abort, make_response
+
+
+def _needs_rehash(context, password_hash, options):
+    if context.needs_update(password_hash):
+        return True
+    rounds = options.get('rounds')
+    if rounds is None:
+        return False
+    handler = context.handler(context.identify(password_hash))
+    # Only ever raise the cost, a lower configured one must not weaken the stored hashes
+    return getattr(handler.from_string(password_hash), 'rounds', rounds) < rounds
+
+
+def _verify(context, password, password_hash, new_password, options):
+    """
+    Runs on the pool: verify password against password_hash and hash new_password again when the hash
+    uses a deprecated scheme or a cost below the configured one. Returns (verified, new hash or None).
+    """
+    if not context.verify(password, password_hash):
+        return False, None
+    if _needs_rehash(context, password_hash, options):
+        return True, context.handler().using(**options).hash(new_password)
+    return True, None
+
+
+class _PasswordVerifierState(object):
+    def __init__(self, threads, queue):
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # Verifications running or waiting for a thread
+        self.slots = threading.BoundedSemaphore(threads + queue)
+        self.lock = threading.Lock()
+        # remote address -> times of its recent login attempts
+        self.attempts = {}
+
+
+class PasswordVerifier(object):
+    """
+    Verifies login passwords on a bounded thread pool and throttles login attempts per client address.
+
+    At most LOGIN_VERIFY_THREADS hashes are computed at once, LOGIN_VERIFY_QUEUE more may wait for a thread,
+    and logins beyond that get 503 instead of tying up more request workers. A client address may POST the
+    login form LOGIN_ATTEMPTS times per LOGIN_ATTEMPTS_WINDOW seconds, further attempts get 429. Behind a
+    reverse proxy the client address is the one it forwards, see PROXY_FIX_X_FOR, otherwise all clients would
+    share the proxy's attempts. The attempts are counted per process: with several workers a client may try
+    up to LOGIN_ATTEMPTS times the number of workers per window.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_VERIFY_THREADS', 2)
+        app.config.setdefault('LOGIN_VERIFY_QUEUE', 8)
+        app.config.setdefault('LOGIN_VERIFY_TIMEOUT', 10)
+        app.config.setdefault('LOGIN_ATTEMPTS', 10)
+        app.config.setdefault('LOGIN_ATTEMPTS_WINDOW', 60)
+        app.extensions['iqupdate_passwords'] = _PasswordVerifierState(app.config['LOGIN_VERIFY_THREADS'],
+                                                                      app.config['LOGIN_VERIFY_QUEUE'])
+        app.before_request(self._throttle)
+
+    def _get_state(self, app=None):
+        return (app or current_app).extensions['iqupdate_passwords']
+
+    def _throttle(self):
+        if request.endpoint != 'security.login' or request.method != 'POST':
+            return None
+        config = current_app.config
+        state = self._get_state()
+        now = time.time()
+        window_start = now - config['LOGIN_ATTEMPTS_WINDOW']
+        with state.lock:
+            attempts = state.attempts.setdefault(request.remote_addr, deque())
+            while attempts and attempts[0] <= window_start:
+                attempts.popleft()
+            if len(attempts) >= config['LOGIN_ATTEMPTS']:
+                retry_after = int(attempts[0] - window_start) + 1
+                response = make_response('Too many login attempts', 429)
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            attempts.append(now)
+            # Forget addresses that stopped trying, so scanning clients can't grow the table forever
+            if len(state.attempts) > 1024:
+                for address in [address for address, times in state.attempts.items()
+                                if not times or times[-1] <= window_start]:
+                    del state.attempts[address]
+        return None
+
+    def verify(self, context, password, password_hash, new_password, options):
+        """
+        Verify password against password_hash on the pool, see _verify. Aborts with 503 when every
+        thread and queue slot is taken or the verification takes longer than LOGIN_VERIFY_TIMEOUT.
+        """
+        state = self._get_state()
+        if not state.slots.acquire(False):
+            abort(503)
+        try:
+            future = state.executor.submit(_verify, context, password, password_hash, new_password, options)
+        except Exception:
+            state.slots.release()
+            raise
+        # The slot is held until the hash is done, even when this request stopped waiting for it
+        future.add_done_callback(lambda future: state.slots.release())
+        try:
+            return future.result(current_app.config['LOGIN_VERIFY_TIMEOUT'])
+        except FutureTimeoutError:
+            abort(503)
+
+
+password_verifier = PasswordVerifier()
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import random
+import time
+from flask import url_for, render_template, request, current_app, make_response, jsonify, abort, \
+    stream_with_context
+from flask_babelex import lazy_gettext as _, get_locale
+from markupsafe import escape
+from werkzeug.http import is_resource_modified
+from iqupdate import db, languages
+from iqupdate.catalog import catalog
+from iqupdate.routing import replica_reads
+
+SERVICE_PACK_FIELDS = ('version_number', 'release_date', 'description', 'url')
+
+
+def _catalog_etag(snapshot, *parts):
+    key = [snapshot.etag] + [str(part) for part in parts]
+    return hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()
+
+
+def _conditional_response(etag, last_modified, render, vary=('Accept-Language',)):
+    """
+    Answer with 304 when the client already holds etag/last_modified, render() is only called otherwise.
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response(render())
+    else:
+        response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['UPDATES_CACHE_MAX_AGE']
+    response.vary.update(vary)
+    return response
+
+
+def listing_etag(snapshot):
+    """
+    ETag of the service pack listing the current request asks for, ?greaterThan=N in the negotiated language.
+    """
+    greater_than = request.args.get('greaterThan')
+    return _catalog_etag(snapshot, 'greaterThan', int(greater_than) if greater_than else 0, get_locale())
+
+
+def listing_not_modified(snapshot):
+    """
+    Whether the client already holds the listing, which is then answered with 304 without rendering it.
+    """
+    return not is_resource_modified(request.environ, etag=listing_etag(snapshot), last_modified=snapshot.last_modified)
+
+
+def wait_arguments(max_timeout):
+    try:
+        version_number = int(request.args['version'])
+        timeout = float(request.args.get('timeout', max_timeout))
+    except (KeyError, ValueError):
+        abort(400)
+    return version_number, max(0.0, min(timeout, max_timeout))
+
+
+def _wsgi_waits_allowed():
+    """
+    Every waiting client holds a request thread of a WSGI worker for up to a few minutes, a couple of them
+    would block the update checks of a whole worker. The ASGI application serves the waiting routes without
+    a thread, on WSGI they only answer with UPDATES_WAIT_ON_WSGI, e.g. on the development server.
+    """
+    if not current_app.config['UPDATES_WAIT_ON_WSGI']:
+        abort(404)
+
+
+def release_event(status):
+    return 'event: release\ndata: {}\n\n'.format(json.dumps(status, sort_keys=True))
+
+
+def init_public_views(application):
+    """
+    The update routes clients poll and the error pages, without Flask-Security or Flask-Admin.
+    """
+    # Serve the public update views from an in-process snapshot of the catalog
+    catalog.init_app(application)
+
+    # Flask views
+    @application.route('/iq7/v1/updates')
+    @replica_reads
+    def updates_view():
+        has_updates_for = request.args.get('hasUpdatesFor')
+        greater_than = request.args.get('greaterThan')
+        version_number = 0
+        if has_updates_for:
+            version_number = int(has_updates_for)
+        elif greater_than:
+            version_number = int(greater_than)
+        snapshot = catalog.snapshot()
+        if has_updates_for:
+            # Hottest call: every client asks at startup, compare against the newest cached version only
+            etag = _catalog_etag(snapshot, 'hasUpdatesFor', version_number)
+            return _conditional_response(etag, snapshot.last_modified,
+                                         lambda: 'true' if snapshot.has_updates_for(version_number) else 'false',
+                                         vary=())
+        service_packs = snapshot.newer_than(version_number)
+        newest = service_packs[-1].version_number if len(service_packs) > 0 else None
+        return _conditional_response(listing_etag(snapshot), snapshot.last_modified,
+                                     lambda: render_template('service_packs.html', service_packs=service_packs,
+                                                             newest_version_number=newest))
+
+    @application.route('/iq7/v2/updates')
+    @replica_reads
+    def updates_json_view():
+        """
+        Service packs newer than ?since=N as JSON, ordered by version number.
+        ?fields=a,b selects the entry fields, ?limit=N pages and "next" continues after the last entry.
+        """
+        try:
+            since = int(request.args.get('since', 0))
+            limit = int(request.args.get('limit', current_app.config['UPDATES_PAGE_LIMIT']))
+        except ValueError:
+            abort(400)
+        fields = request.args.get('fields')
+        fields = tuple(fields.split(',')) if fields else SERVICE_PACK_FIELDS
+        if not 0 < limit <= current_app.config['UPDATES_PAGE_LIMIT'] or set(fields) - set(SERVICE_PACK_FIELDS):
+            abort(400)
+
+        snapshot = catalog.snapshot()
+
+        def render():
+            newer = snapshot.entries_after(since)
+            page = newer[:limit]
+            service_packs = []
+            for entry in page:
+                values = {
+                    'version_number': entry.version_number,
+                    'release_date': entry.release_date.isoformat(),
+                    'description': entry.description,
+                    'url': url_for('service_pack_info_view', version_number='{:04d}'.format(entry.version_number)),
+                }
+                service_packs.append(dict((field, values[field]) for field in fields))
+            next_url = None
+            if len(newer) > limit:
+                next_url = url_for('updates_json_view', since=page[-1].version_number, limit=limit,
+                                   fields=request.args.get('fields'))
+            return jsonify(newest_version_number=snapshot.max_version_number, service_packs=service_packs,
+                           next=next_url)
+
+        etag = _catalog_etag(snapshot, 'json', since, limit, ','.join(fields))
+        return _conditional_response(etag, snapshot.last_modified, render, vary=())
+
+    @application.route('/iq7/v1/updates/wait')
+    @replica_reads
+    def updates_wait_view():
+        """
+        Long poll: answer as soon as a version newer than ?version=N is published, or after ?timeout=seconds.
+        Served by the ASGI application, see _wsgi_waits_allowed.
+        """
+        _wsgi_waits_allowed()
+        version_number, timeout = wait_arguments(current_app.config['UPDATES_WAIT_TIMEOUT'])
+        snapshot = catalog.wait_for_update(version_number, timeout)
+        response = jsonify(snapshot.update_status(version_number))
+        response.cache_control.no_store = True
+        return response
+
+    @application.route('/iq7/v1/updates/events')
+    @replica_reads
+    def updates_events_view():
+        """
+        Server-Sent Events: a "release" event whenever a version newer than the last one seen is published.
+        Served by the ASGI application, see _wsgi_waits_allowed.
+        """
+        _wsgi_waits_allowed()
+        version_number, timeout = wait_arguments(current_app.config['UPDATES_EVENTS_TIMEOUT'])
+        heartbeat = current_app.config['UPDATES_EVENTS_HEARTBEAT']
+
+        def events(version_number):
+            deadline = time.time() + timeout
+            yield 'retry: {}\n\n'.format(int(heartbeat * 1000))
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                snapshot = catalog.wait_for_update(version_number, min(heartbeat, remaining))
+                if snapshot.has_updates_for(version_number):
+                    yield release_event(snapshot.update_status(version_number))
+                    version_number = snapshot.max_version_number
+                else:
+                    yield ': keep-alive\n\n'
+
+        response = current_app.response_class(stream_with_context(events(version_number)),
+                                              mimetype='text/event-stream')
+        response.cache_control.no_store = True
+        return response
+
+    @application.route('/iq7/v1/updates/notes')
+    @replica_reads
+    def updates_notes_view():
+        """
+        What changed since my version: the release notes of every service pack newer than ?from=N up to and
+        including ?to=M (default the newest), in version order, each in ?language= or the Accept-Language.
+        """
+        snapshot = catalog.snapshot()
+        try:
+            from_version_number = int(request.args['from'])
+            to_version_number = int(request.args.get('to', snapshot.max_version_number or 0))
+        except (KeyError, ValueError):
+            abort(400)
+        language = request.args.get('language')
+        chain = languages.chain(language)
+        entries = snapshot.entries_between(from_version_number, to_version_number)
+
+        def notes():
+            entry_languages = [languages.best_match(entry.languages, language) for entry in entries]
+            for entry, contents in snapshot.iter_notes(entries, entry_languages):
+                yield u'<h2>{}</h2>\n{}\n'.format(escape(entry.description), contents)
+
+        def render():
+            if len(entries) > current_app.config['UPDATES_NOTES_STREAM_THRESHOLD']:
+                # Sent as the rows arrive instead of holding the whole range in memory and in the cache
+                return current_app.response_class(stream_with_context(notes()), mimetype='text/html')
+            key = (from_version_number, to_version_number, chain)
+            html = snapshot.cumulative_notes.get(key)
+            if html is None:
+                html = u''.join(notes())
+                snapshot.cumulative_notes.set(key, html)
+            return html
+
+        etag = _catalog_etag(snapshot, 'cumulative', from_version_number, to_version_number, ','.join(chain))
+        last_modified = max([entry.changed_at for entry in entries] or [snapshot.last_modified])
+        return _conditional_response(etag, last_modified, render)
+
+    @application.route('/iq7/v1/updates/check', methods=['POST'])
+    @replica_reads
+    def updates_batch_view():
+        """
+        Check in many installations at once, e.g. for a license server proxying its workstations.
+        Accepts {"installed": [161, {"version": 170, "language": "de"}, ...]} and answers per entry.
+        """
+        payload = request.get_json(silent=True)
+        installed = payload.get('installed') if isinstance(payload, dict) else None
+        if not isinstance(installed, list) or len(installed) > current_app.config['UPDATES_BATCH_LIMIT']:
+            abort(400)
+        try:
+            installations = [(int(item['version']), item.get('language')) if isinstance(item, dict)
+                             else (int(item), None) for item in installed]
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        snapshot = catalog.snapshot()
+        # Every distinct installed version is resolved once by bisecting the sorted catalog
+        newer_versions = dict((version_number, snapshot.newer_version_numbers(version_number))
+                              for version_number in sorted(set(version for version, language in installations)))
+        results = []
+        for version_number, language in installations:
+            newer = newer_versions[version_number]
+            result = {
+                'version': version_number,
+                'has_updates': len(newer) > 0,
+                'newest_version_number': snapshot.max_version_number,
+                'newer_versions': newer,
+            }
+            if language:
+                result['language'] = language
+                result['notes'] = [url_for('service_pack_info_view', version_number='{:04d}'.format(newer_version),
+                                           language=language) for newer_version in newer]
+            results.append(result)
+        return jsonify(newest_version_number=snapshot.max_version_number, results=results)
+
+    @application.route('/iq7/v1/updates/<version_number>')
+    @replica_reads
+    def service_pack_info_view(version_number):
+        back_url = request.referrer
+        if back_url is None:
+            back_url = '/iq7/v1/updates'
+        snapshot = catalog.snapshot()
+        service_pack = snapshot.get(int(version_number))
+        # ?language= or Accept-Language, falling back along the chain to a language the notes exist in
+        language = languages.best_match(service_pack.languages if service_pack else (), request.args.get('language'))
+        encoding = 'gzip' if request.accept_encodings['gzip'] else None
+
+        def render():
+            note = snapshot.note(service_pack.id, language) if language else None
+            back_html = '<p><a href="' + back_url + '">' + _(u'Back') + '</a></p>'
+            if note is None:
+                return back_html
+            if encoding == 'gzip':
+                # The note was compressed when it was loaded, only the back link is compressed here
+                response = make_response(note.gzip.gzip(back_html.encode('utf-8')))
+                response.content_type = 'text/html; charset=utf-8'
+                response.content_encoding = 'gzip'
+                return response
+            return '{}{}'.format(note.contents, back_html)
+
+        etag = _catalog_etag(snapshot, 'notes', int(version_number), language, back_url, get_locale(), encoding)
+        last_modified = service_pack.changed_at if service_pack else snapshot.last_modified
+        return _conditional_response(etag, last_modified, render,
+                                     vary=('Accept-Language', 'Accept-Encoding', 'Referer'))
+
+    @application.errorhandler(403)
+    def forbidden(error):
+        """
+        render to 403.html
+        :return:
+        """
+        application.logger.info(error)
+        return render_template('403.html'), 403
+
+    @application.errorhandler(404)
+    def page_not_found(error):
+        """
+        render to 404.html
+        :return:
+        """
+        # Scanners probing for URLs cause most 404s, only a sample is logged
+        if random.random() < current_app.config['LOG_404_SAMPLE_RATE']:
+            application.logger.info('%s %s (1 in %s 404s logged)', error, request.path,
+                                    int(round(1 / current_app.config['LOG_404_SAMPLE_RATE'])))
+        return render_template('404.html'), 404
+
+    @application.errorhandler(500)
+    def internal_server_error(error):
+        """
+        render to 500.html
+        :return:
+        """
+        db.session.rollback()
+        application.logger.info(error)
+        return render_template('500.html'), 500
+
+    return application
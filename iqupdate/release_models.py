@@ -0,0 +1,48 @@
+from datetime import datetime
+from iqupdate import db as database
+from config import Config
+
+
+class ServicePack(database.Model):
+    __table_args__ = (
+        # Keyset pagination of the admin list, newest first
+        database.Index('ix_service_pack_release_date_id', 'release_date', 'id'),
+    )
+
+    id = database.Column(database.Integer(), primary_key=True)
+    description = database.Column(database.String(20), unique=True, nullable=False)
+    version_number = database.Column(database.Integer(), unique=True, nullable=False)
+    release_date = database.Column(database.Date(), nullable=False)
+    last_modified = database.Column(database.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __str__(self):
+        return "{} - {}".format(self.description, self.release_date)
+
+
+class ServicePackDetail(database.Model):
+    __table_args__ = (
+        database.Index('ix_service_pack_detail_service_pack_id_language', 'service_pack_id', 'language',
+                       unique=True),
+    )
+
+    id = database.Column(database.Integer(), primary_key=True)
+    language = database.Column(database.Enum(*Config.LANGUAGES), nullable=False)
+    # Only loaded when a note is shown, not with every detail row
+    contents = database.deferred(database.Column(database.Text, nullable=False))
+    service_pack_id = database.Column(database.Integer, database.ForeignKey(ServicePack.id, ondelete='CASCADE'),
+                                      nullable=False)
+    service_pack = database.relation(ServicePack, backref=database.backref('details', cascade='all, delete-orphan'))
+
+    def __str__(self):
+        return "{} - {}".format(self.language, self.contents)
+
+    def __repr__(self):
+        return self.__str__
+
+
+class CatalogGeneration(database.Model):
+    """
+    Single row counting catalog changes, so every process notices a change made by another one.
+    """
+    id = database.Column(database.Integer(), primary_key=True)
+    generation = database.Column(database.Integer(), nullable=False, default=0)
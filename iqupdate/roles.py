@@ -0,0 +1,69 @@
+import threading
+import time
+from flask import current_app, g, has_app_context
+
+
+class _RoleCacheState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        # user id -> (generation, expires, frozenset of role names)
+        self.entries = {}
+
+
+class RoleCache(object):
+    """
+    Per-process cache of the role names of logged-in users for the admin access checks.
+
+    A user's roles are read once per ROLE_CACHE_TIMEOUT seconds instead of on every admin request,
+    and only once per request. invalidate() drops every cached entry, MyModelView does this whenever
+    a user or role is saved or deleted; other processes pick the change up after the timeout.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ROLE_CACHE_TIMEOUT', 60)
+        app.extensions['iqupdate_roles'] = _RoleCacheState()
+
+    def _get_state(self, app=None):
+        return (app or current_app).extensions['iqupdate_roles']
+
+    def invalidate(self, app=None):
+        state = self._get_state(app)
+        with state.lock:
+            state.generation += 1
+            state.entries.clear()
+        if has_app_context():
+            g.pop('iqupdate_roles', None)
+
+    def roles(self, user):
+        """
+        Role names of user, an empty set for anonymous users.
+        """
+        if not user.is_authenticated:
+            return frozenset()
+        cached = g.get('iqupdate_roles')
+        if cached is not None and cached[0] == user.id:
+            return cached[1]
+
+        state = self._get_state()
+        now = time.time()
+        with state.lock:
+            generation = state.generation
+            entry = state.entries.get(user.id)
+        if entry is not None and entry[0] == generation and entry[1] > now:
+            names = entry[2]
+        else:
+            names = frozenset(role.name for role in user.roles)
+            with state.lock:
+                # An invalidation while the roles were read leaves them uncached
+                if state.generation == generation:
+                    state.entries[user.id] = (generation, now + current_app.config['ROLE_CACHE_TIMEOUT'], names)
+        g.iqupdate_roles = (user.id, names)
+        return names
+
+    def has_role(self, user, name):
+        return name in self.roles(user)
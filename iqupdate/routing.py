@@ -0,0 +1,99 @@
+import random
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+
+PRIMARY_UNTIL_KEY = 'iqupdate_primary_until'
+
+
+def replica_reads(view):
+    """
+    Mark a read-only view whose queries may be answered by a read replica.
+    """
+    view.replica_reads = True
+    return view
+
+
+@contextmanager
+def primary():
+    """
+    Send every query of the current request inside the block to the primary database.
+    """
+    previous = g.get('iqupdate_primary', False)
+    g.iqupdate_primary = True
+    try:
+        yield
+    finally:
+        g.iqupdate_primary = previous
+
+
+def _reads_from_replica():
+    if not has_request_context() or g.get('iqupdate_primary', False):
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'replica_reads', False):
+        return False
+    # Read-your-writes: whoever just saved something keeps reading from the primary for a while
+    return session.get(PRIMARY_UNTIL_KEY, 0) < time.time()
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending reads of replica_reads views to a random replica bind, everything else to the primary.
+    """
+
+    def __init__(self, db, **options):
+        self.routing_db = db
+        self.wrote = False
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.config['SQLALCHEMY_REPLICA_BINDS']
+        if replicas and not self._flushing and _reads_from_replica():
+            return self.routing_db.get_engine(self.app, random.choice(replicas))
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(db_session, flush_context):
+    db_session.wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(db_session):
+    if db_session.wrote and has_request_context():
+        session[PRIMARY_UNTIL_KEY] = time.time() + current_app.config['SQLALCHEMY_REPLICA_LAG']
+    db_session.wrote = False
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(db_session):
+    db_session.wrote = False
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with read replicas.
+
+    SQLALCHEMY_REPLICA_URIS become the binds replica0, replica1, ... Views marked with replica_reads read
+    from one of them, Flask-Admin and every write use the primary. After a commit the same browser session
+    reads from the primary for SQLALCHEMY_REPLICA_LAG seconds.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('SQLALCHEMY_REPLICA_LAG', 5)
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        replicas = []
+        for index, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS']):
+            bind = 'replica{}'.format(index)
+            binds[bind] = uri
+            replicas.append(bind)
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        app.config['SQLALCHEMY_REPLICA_BINDS'] = replicas
+        super(RoutingSQLAlchemy, self).init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
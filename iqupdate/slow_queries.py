@@ -0,0 +1,135 @@
+import re
+import threading
+from collections import defaultdict
+from flask import current_app, has_app_context, has_request_context, request
+from iqupdate import sql_timing
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|(?<!:):\w+')
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+# Prefixes asking each dialect for the plan instead of running the statement
+EXPLAIN_PREFIXES = {'sqlite': 'EXPLAIN QUERY PLAN ', 'mysql': 'EXPLAIN ', 'postgresql': 'EXPLAIN '}
+
+
+def normalize(statement):
+    """
+    Shape of a statement: literals and bound parameters become ?, IN lists of any length become IN (...).
+    """
+    shape = _STRING.sub('?', statement)
+    shape = _PLACEHOLDER.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = _IN_LIST.sub('IN (...)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class SlowStatement(object):
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.endpoints = defaultdict(int)
+        self.last_parameters = None
+        self.explain = None
+
+    def copy(self):
+        copied = SlowStatement(self.shape)
+        copied.__dict__.update(self.__dict__)
+        copied.endpoints = dict(self.endpoints)
+        return copied
+
+    @property
+    def mean_seconds(self):
+        return self.total_seconds / self.count if self.count else 0.0
+
+
+class _SlowQueryState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # normalized statement -> SlowStatement
+        self.statements = {}
+
+
+def _explain(conn, cursor, statement, parameters):
+    """
+    Query plan of statement as a list of row strings, on a cursor of its own so the results of cursor stay.
+    """
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith('SELECT'):
+        return None
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters)
+        return [' | '.join(str(value) for value in row) for row in explain_cursor.fetchall()]
+    except Exception as error:
+        return ['EXPLAIN failed: {}'.format(error)]
+    finally:
+        explain_cursor.close()
+
+
+def _record_statement(conn, cursor, statement, parameters, executemany, duration):
+    if not has_app_context():
+        return
+    app = current_app._get_current_object()
+    state = app.extensions.get('iqupdate_slow_queries')
+    threshold = app.config.get('SLOW_QUERY_THRESHOLD')
+    if state is None or threshold is None or duration < threshold:
+        return
+    endpoint = (request.endpoint or 'unmatched') if has_request_context() else 'cli'
+    shown_parameters = repr(parameters)[:app.config['SLOW_QUERY_PARAMETERS_LENGTH']]
+    app.logger.warning('Slow query (%.3fs in %s): %s %s', duration, endpoint, statement, shown_parameters)
+
+    shape = normalize(statement)
+    with state.lock:
+        slow = state.statements.get(shape)
+        first = slow is None
+        if first:
+            if len(state.statements) >= app.config['SLOW_QUERY_MAX_STATEMENTS']:
+                return
+            slow = state.statements[shape] = SlowStatement(shape)
+        slow.count += 1
+        slow.total_seconds += duration
+        slow.max_seconds = max(slow.max_seconds, duration)
+        slow.endpoints[endpoint] += 1
+        slow.last_parameters = shown_parameters
+    if first and app.config['SLOW_QUERY_EXPLAIN'] and not executemany:
+        slow.explain = _explain(conn, cursor, statement, parameters)
+
+
+class SlowQueryRecorder(object):
+    """
+    Logs every statement taking SLOW_QUERY_THRESHOLD seconds or longer with its parameters and the endpoint
+    it ran for, and aggregates them by statement shape for the admin's slow query page. The first time a
+    SELECT of a shape is slow its EXPLAIN output is kept (SLOW_QUERY_EXPLAIN). At most
+    SLOW_QUERY_MAX_STATEMENTS shapes are kept per process, a threshold of None turns recording off.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD', 0.1)
+        app.config.setdefault('SLOW_QUERY_EXPLAIN', True)
+        app.config.setdefault('SLOW_QUERY_MAX_STATEMENTS', 200)
+        app.config.setdefault('SLOW_QUERY_PARAMETERS_LENGTH', 200)
+        app.extensions['iqupdate_slow_queries'] = _SlowQueryState()
+        sql_timing.on_statement(_record_statement)
+
+    def _get_state(self, app=None):
+        return (app or current_app).extensions['iqupdate_slow_queries']
+
+    def statements(self, app=None):
+        """
+        Copies of the recorded statement shapes, the ones with the most time spent first.
+        """
+        state = self._get_state(app)
+        with state.lock:
+            statements = [slow.copy() for slow in state.statements.values()]
+        return sorted(statements, key=lambda slow: slow.total_seconds, reverse=True)
+
+
+slow_query_log = SlowQueryRecorder()
@@ -0,0 +1,38 @@
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Called after every statement of every engine, see on_statement
+_listeners = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context, which a failing statement leaves behind along with its start
+    # time. The few statements without one share a single slot of the connection.
+    started = time.perf_counter()
+    if context is not None:
+        context.iqupdate_query_started = started
+    else:
+        conn.info['iqupdate_query_started'] = started
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        started = context.iqupdate_query_started
+    else:
+        started = conn.info.pop('iqupdate_query_started')
+    duration = time.perf_counter() - started
+    for listener in _listeners:
+        listener(conn, cursor, statement, parameters, executemany, duration)
+
+
+def on_statement(listener):
+    """
+    Call listener(conn, cursor, statement, parameters, executemany, duration) after every SQL statement.
+    All listeners share one pair of engine events timing each statement once.
+    """
+    if not _listeners:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    if listener not in _listeners:
+        _listeners.append(listener)
@@ -0,0 +1,220 @@
+import gzip
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from flask import current_app, render_template
+from flask_babelex import gettext
+from iqupdate import db as database
+from iqupdate.catalog import catalog
+from iqupdate.release_models import ServicePackDetail
+
+CURRENT = 'current'
+LOCK_FILE = '.lock'
+UPDATES_PATH = os.path.join('iq7', 'v1', 'updates')
+
+
+@contextmanager
+def _export_lock(root):
+    """
+    Exclusive flock on root/.lock, opened by every export: flocks of separate opens exclude each other within
+    a process too. fcntl is POSIX only, it is imported here so the admin still runs on Windows without export.
+    """
+    import fcntl
+    with open(os.path.join(root, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+class _TreeWriter(object):
+    """
+    Writes files and their .gz variants into a tree. Every file replaces the previous one with a rename, so
+    readers of a live tree see either the old or the new file, and files that are unchanged are left alone.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.written = 0
+        self.removed = 0
+
+    def write(self, path, data):
+        target = os.path.join(self.tree, path)
+        if os.path.exists(target + '.gz'):
+            with open(target, 'rb') as current:
+                if current.read() == data:
+                    return
+        directory = os.path.dirname(target)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # mtime=0 keeps the compressed bytes equal for equal files
+        self._replace(target + '.gz', gzip.compress(data, 9, mtime=0))
+        self._replace(target, data)
+        self.written += 1
+
+    def _replace(self, target, data):
+        # Only the export holding the lock writes, a fixed temporary name is enough
+        temporary = target + '.tmp'
+        with open(temporary, 'wb') as output:
+            output.write(data)
+        os.rename(temporary, target)
+
+    def remove(self, path):
+        """
+        Remove the file at path with its .gz variant, or the directory at path.
+        """
+        target = os.path.join(self.tree, path)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+            self.removed += 1
+        elif os.path.exists(target):
+            os.remove(target)
+            if os.path.exists(target + '.gz'):
+                os.remove(target + '.gz')
+            self.removed += 1
+
+    def list(self, path):
+        directory = os.path.join(self.tree, path)
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+
+class StaticExporter(object):
+    """
+    Publishes the public update data as static files under STATIC_EXPORT_DIR, for nginx or a CDN to serve:
+
+        current/iq7/v1/updates/index.html, index.<language>.html    listing of all service packs
+        current/iq7/v1/updates/hasUpdatesFor/<N>                    "true" or "false" for every known version
+        current/iq7/v1/updates/<N>/<language>.html                  release notes with the back link
+        ... and a .gz variant of every file
+
+    A full export writes a new tree next to the current one and then switches the current symlink to it, so
+    readers never see a half written tree. An export of the service packs an admin save changed updates the
+    current tree in place instead: the listings, the notes of those service packs and the hasUpdatesFor answers
+    that changed are replaced file by file, the files of the other service packs are not touched. Version
+    numbers are written without leading zeros. An exclusive flock on STATIC_EXPORT_DIR/.lock lets one export
+    of all workers and threads run at a time.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATIC_EXPORT_DIR', None)
+
+    def is_enabled(self, app=None):
+        return bool((app or current_app).config['STATIC_EXPORT_DIR'])
+
+    def export(self, service_pack_ids=None):
+        """
+        Export the catalog and return the path of the tree. Without service_pack_ids, or before the first
+        export, a new tree is written and swapped in. With service_pack_ids the current tree is updated for
+        the service packs saved or deleted since the last export, deleted ones need not be listed.
+        """
+        app = current_app._get_current_object()
+        root = app.config['STATIC_EXPORT_DIR']
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        with _export_lock(root):
+            current = os.path.join(root, CURRENT)
+            if service_pack_ids is not None and os.path.isdir(current):
+                tree = os.path.realpath(current)
+                self._update_tree(app, _TreeWriter(tree), service_pack_ids)
+                return tree
+            tree = tempfile.mkdtemp(prefix='tree-', dir=root)
+            os.chmod(tree, 0o755)
+            try:
+                self._write_tree(app, _TreeWriter(tree))
+            except Exception:
+                shutil.rmtree(tree)
+                raise
+            link = os.path.join(root, CURRENT + '.new')
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(os.path.basename(tree), link)
+            os.rename(link, current)
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if name.startswith('tree-') and path != tree:
+                    shutil.rmtree(path, ignore_errors=True)
+        return tree
+
+    def _write_tree(self, app, writer):
+        snapshot = catalog.snapshot()
+        back_html = self._write_listings(app, writer, snapshot)
+        for entry in snapshot.entries:
+            self._write_has_updates_for(writer, snapshot, entry)
+        self._write_notes(app, writer, snapshot.entries, back_html)
+
+    def _update_tree(self, app, writer, service_pack_ids):
+        snapshot = catalog.snapshot()
+        back_html = self._write_listings(app, writer, snapshot)
+
+        # The exported versions are the names in hasUpdatesFor, without their .gz variants
+        exported = set(int(name) for name in writer.list(os.path.join(UPDATES_PATH, 'hasUpdatesFor'))
+                       if name.isdigit())
+        for version_number in exported - set(snapshot.version_numbers):
+            writer.remove(os.path.join(UPDATES_PATH, 'hasUpdatesFor', str(version_number)))
+            writer.remove(os.path.join(UPDATES_PATH, str(version_number)))
+
+        # Only the versions between the old and the new newest one change their answer
+        low, high = sorted([max(exported) if exported else 0, snapshot.max_version_number or 0])
+        changed_ids = set(service_pack_ids)
+        changed = [entry for entry in snapshot.entries
+                   if entry.id in changed_ids or entry.version_number not in exported]
+        for entry in snapshot.entries:
+            if entry.id in changed_ids or entry.version_number not in exported or \
+                    low <= entry.version_number < high:
+                self._write_has_updates_for(writer, snapshot, entry)
+
+        # Notes of languages a changed service pack no longer has
+        for entry in changed:
+            directory = os.path.join(UPDATES_PATH, str(entry.version_number))
+            for name in writer.list(directory):
+                if name.endswith('.html') and name[:-len('.html')] not in entry.languages:
+                    writer.remove(os.path.join(directory, name))
+        self._write_notes(app, writer, changed, back_html)
+
+    def _write_listings(self, app, writer, snapshot):
+        """
+        Write the listing in every language and return the back links of the notes by language.
+        """
+        default_language = app.config['BABEL_DEFAULT_LOCALE']
+        service_packs = snapshot.newer_than(0)
+        newest = service_packs[-1].version_number if service_packs else None
+        back_html = {}
+        for language in app.config['LANGUAGES']:
+            headers = {'Accept-Language': language.replace('_', '-')}
+            with app.test_request_context('/iq7/v1/updates', headers=headers):
+                listing = render_template('service_packs.html', service_packs=service_packs,
+                                          newest_version_number=newest).encode('utf-8')
+                back_html[language] = '<p><a href="/iq7/v1/updates">' + gettext(u'Back') + '</a></p>'
+            writer.write(os.path.join(UPDATES_PATH, 'index.{}.html'.format(language)), listing)
+            if language == default_language:
+                writer.write(os.path.join(UPDATES_PATH, 'index.html'), listing)
+        return back_html
+
+    def _write_has_updates_for(self, writer, snapshot, entry):
+        writer.write(os.path.join(UPDATES_PATH, 'hasUpdatesFor', str(entry.version_number)),
+                     b'true' if snapshot.has_updates_for(entry.version_number) else b'false')
+
+    def _write_notes(self, app, writer, entries, back_html):
+        """
+        Write the notes of entries in all their languages, read with one query.
+        """
+        if not entries:
+            return
+        default_language = app.config['BABEL_DEFAULT_LOCALE']
+        by_id = dict((entry.id, entry) for entry in entries)
+        query = database.session.query(ServicePackDetail.service_pack_id, ServicePackDetail.language,
+                                       ServicePackDetail.contents)
+        if len(by_id) < len(catalog.snapshot().entries):
+            query = query.filter(ServicePackDetail.service_pack_id.in_(sorted(by_id)))
+        for service_pack_id, language, contents in query.yield_per(100):
+            entry = by_id.get(service_pack_id)
+            if entry is not None:
+                back = back_html.get(language, back_html[default_language])
+                path = os.path.join(UPDATES_PATH, str(entry.version_number), '{}.html'.format(language))
+                writer.write(path, u'{}{}'.format(contents, back).encode('utf-8'))
+
+
+static_export = StaticExporter()
@@ -0,0 +1,51 @@
+import random
+from datetime import date, timedelta
+from iqupdate.models import ServicePack, ServicePackDetail
+from iqupdate import db as database
+
+WORDS = ('Editor', 'FMEA', 'Formblatt', 'Diagramm', 'Export', 'Import', 'Report', 'Variante', 'Matrix',
+         'display', 'object', 'names', 'rows', 'columns', 'incomplete', 'fixed', 'error', 'print', 'web')
+
+
+def synthetic_note(rng, language, version_number, note_size):
+    """
+    HTML release note of about note_size characters, shaped like the ones in init_example_database.
+    """
+    parts = ['<p><B><U>{}:</U></B></p><UL>'.format('Allgemein' if language == 'de' else 'General')]
+    size = len(parts[0])
+    while size < note_size:
+        item = '<li> RP-{}: {} {}.</li>'.format(rng.randint(1000, 9999), ' '.join(rng.choice(WORDS)
+                                                                                  for _ in range(12)),
+                                                version_number)
+        parts.append(item)
+        size += len(item)
+    parts.append('</UL>')
+    return ''.join(parts)
+
+
+def init_synthetic_database(app, packs=5000, languages=None, note_size=4096, batch_size=500, seed=0):
+    """
+    Fill an empty service pack catalog with packs x languages generated release notes, using batched inserts.
+    Languages default to every value ServicePackDetail.language accepts.
+    """
+    languages = languages or ServicePackDetail.language.type.enums
+    rng = random.Random(seed)
+    first_release = date(2000, 1, 1)
+    with app.app_context():
+        for start in range(0, packs, batch_size):
+            database.session.execute(ServicePack.__table__.insert(), [
+                {'description': 'Version 7.0 {:04d}'.format(version_number), 'version_number': version_number,
+                 'release_date': first_release + timedelta(days=version_number)}
+                for version_number in range(start + 1, min(start + batch_size, packs) + 1)])
+        ids = database.session.query(ServicePack.version_number, ServicePack.id).all()
+        details = []
+        for version_number, service_pack_id in sorted(ids):
+            for language in languages:
+                details.append({'service_pack_id': service_pack_id, 'language': language,
+                                'contents': synthetic_note(rng, language, version_number, note_size)})
+                if len(details) == batch_size:
+                    database.session.execute(ServicePackDetail.__table__.insert(), details)
+                    details = []
+        if details:
+            database.session.execute(ServicePackDetail.__table__.insert(), details)
+        database.session.commit()
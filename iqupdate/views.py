@@ -1,86 +1,31 @@
-from flask import url_for, render_template, request
+from flask import url_for
+from flask_principal import identity_loaded
 from flask_security import Security, SQLAlchemyUserDatastore
+from flask_security.core import _on_identity_loaded
 import flask_admin
 from flask_admin import helpers as admin_helpers
-from flask_babelex import lazy_gettext as _
 from iqupdate import db
-from iqupdate.models import Role, User, ServicePack, ServicePackDetail
-from iqupdate.forms import MyModelView, ServicePackAdmin
+from iqupdate.models import Role, User
+from iqupdate.forms import MyModelView, ServicePackAdmin, SlowQueryView, PooledLoginForm, load_identity
+from iqupdate.passwords import password_verifier
+from iqupdate.public_views import init_public_views
+from iqupdate.static_export import static_export
 
 
 def init_views(application):
-    # Setup Flask-Security
+    # Setup Flask-Security, with the cheap hash cost when testing however the app was put into testing mode
+    if application.testing and application.config.get('TESTING_PASSWORD_HASH_OPTIONS'):
+        application.config['SECURITY_PASSWORD_HASH_OPTIONS'] = application.config['TESTING_PASSWORD_HASH_OPTIONS']
     user_datastore = SQLAlchemyUserDatastore(db, User, Role)
-    security = Security(application, user_datastore)
+    security = Security(application, user_datastore, login_form=PooledLoginForm)
+    password_verifier.init_app(application)
+    # Role needs from the role cache instead of a roles query on every request
+    identity_loaded.disconnect(_on_identity_loaded, sender=application)
+    identity_loaded.connect_via(application)(load_identity)
 
-    # Flask views
-    @application.route('/iq7/v1/updates')
-    def updates_view():
-        has_updates_for = request.args.get('hasUpdatesFor')
-        greater_than = request.args.get('greaterThan')
-        version_number = 0
-        if has_updates_for:
-            version_number = int(has_updates_for)
-        elif greater_than:
-            version_number = int(greater_than)
-        service_packs = ServicePack.query.order_by(ServicePack.release_date).filter(
-            ServicePack.version_number > version_number).all()
-        if has_updates_for:
-            return 'true' if len(service_packs) > 0 else 'false'
-        newest = service_packs[-1].version_number if len(service_packs) > 0 else None
-        return render_template('service_packs.html', service_packs=service_packs,
-                               newest_version_number=newest)
-
-    @application.route('/iq7/v1/updates/<version_number>')
-    def service_pack_info_view(version_number):
-        # Czech Deutsch English Spanish French Italian Hungarian Korean Chinese(Taiwan) Chinese(Simplified) Japanese
-        # cs    de      en      es      fr     it      hu        ko     zh_tw           zh                  ja
-        language = request.args.get('language')
-        if language is None:
-            language = request.accept_languages.best_match(
-                ['cs', 'de', 'en', 'es', 'fr', 'it', 'hu', 'ko', 'zh_TW', 'zh', 'ja'])
-        if language != 'de':
-            language = 'en'
-        back_url = request.referrer
-        if back_url is None:
-            back_url = '/iq7/v1/updates'
-        service_pack = ServicePack.query.filter_by(version_number=int(version_number)).first()
-        contents = ''
-        if service_pack:
-            detail = ServicePackDetail.query.filter(ServicePackDetail.service_pack_id == service_pack.id,
-                                                    ServicePackDetail.language == language).first()
-            if detail:
-                contents = detail.contents
-        back_html = '<p><a href="' + back_url + '">' + _(u'Back') + '</a></p>'
-        return '{}{}'.format(contents, back_html)
-
-    @application.errorhandler(403)
-    def forbidden(error):
-        """
-        render to 403.html
-        :return:
-        """
-        application.logger.info(error)
-        return render_template('403.html'), 403
-
-    @application.errorhandler(404)
-    def page_not_found(error):
-        """
-        render to 404.html
-        :return:
-        """
-        application.logger.info(error)
-        return render_template('404.html'), 404
-
-    @application.errorhandler(500)
-    def internal_server_error(error):
-        """
-        render to 500.html
-        :return:
-        """
-        db.session.rollback()
-        application.logger.info(error)
-        return render_template('500.html'), 500
+    # The public update routes and the error pages
+    init_public_views(application)
+    static_export.init_app(application)
 
     # Create admin
     admin = flask_admin.Admin(
@@ -94,6 +39,7 @@ def init_views(application):
     admin.add_view(MyModelView(Role, db.session))
     admin.add_view(MyModelView(User, db.session))
     admin.add_view(ServicePackAdmin())
+    admin.add_view(SlowQueryView(name='Slow queries', endpoint='slow_queries'))
 
     # define a context processor for merging flask-admin's template context into the
     # flask-security views.
@@ -0,0 +1,93 @@
+import sys
+import time
+from flask_babelex import get_domain
+from iqupdate import db
+from iqupdate.catalog import catalog
+
+
+def _translation_domains(app):
+    domains = [get_domain()]
+    if 'security' in app.extensions:
+        domains.append(app.extensions['security'].i18n_domain)
+    # Flask-Admin's own messages and its WTForms messages, only with the full application
+    admin_babel = sys.modules.get('flask_admin.babel')
+    if admin_babel is not None and hasattr(admin_babel, 'domain'):
+        domains += [admin_babel.domain, admin_babel.wtforms_domain]
+    return domains
+
+
+def _engines(app):
+    return [db.get_engine(app, bind) for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())]
+
+
+def load_templates(app):
+    """
+    Compile every template the application can render into the Jinja cache.
+    """
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def load_translations(app):
+    """
+    Load the message catalogs of every language in LANGUAGES for all translation domains.
+    """
+    for language in app.config['LANGUAGES']:
+        with app.test_request_context(headers={'Accept-Language': language.replace('_', '-')}):
+            for domain in _translation_domains(app):
+                domain.get_translations()
+    return len(app.config['LANGUAGES'])
+
+
+def open_connections(app, count):
+    """
+    Open count connections of every engine and return them to its pool.
+    """
+    with app.app_context():
+        for engine in _engines(app):
+            connections = [engine.connect() for _ in range(count)]
+            for connection in connections:
+                connection.close()
+    return count
+
+
+def load_catalog(app):
+    """
+    Load the catalog snapshot of the public update views.
+    """
+    if 'iqupdate_catalog' not in app.extensions:
+        return 0
+    with app.test_request_context():
+        return len(catalog.snapshot(app).entries)
+
+
+def dispose_engines(app):
+    """
+    Close the pooled connections, so workers forked afterwards don't inherit and share their sockets.
+    """
+    with app.app_context():
+        for engine in _engines(app):
+            engine.dispose()
+
+
+def warm_up(app, connections=1, steps=None):
+    """
+    Run the warm-up steps, all of them by default, so the first requests of a worker don't pay for compiling
+    templates, reading message catalogs, connecting to the database and loading the catalog. Every step is
+    logged with its duration.
+    """
+    available = (
+        ('templates', load_templates),
+        ('translations', load_translations),
+        ('connections', lambda app: open_connections(app, connections)),
+        ('catalog', load_catalog),
+    )
+    for name, step in available:
+        if steps is not None and name not in steps:
+            continue
+        started = time.perf_counter()
+        count = step(app)
+        app.logger.info('Warm-up: %s %s in %.3fs', count, name, time.perf_counter() - started)
+    return app
@@ -1,26 +1,40 @@
 import os
+import shutil
 import tempfile
 import pytest
+from sqlalchemy import event
 
 from config import Config
-from iqupdate import db, views
+from iqupdate import db, views, commands
 from iqupdate.example_database import init_example_database
 from iqupdate import create_app
 
 
+@pytest.fixture(scope='session')
+def template_database(tmp_path_factory):
+    """SQLite file with the schema and the example data, built once per session."""
+    db_path = str(tmp_path_factory.mktemp('template') / 'iq_update.db')
+    app = create_app(Config(True, 'sqlite:///' + db_path))
+    views.init_views(app)
+    with app.app_context():
+        db.create_all()
+        init_example_database(app)
+        db.session.remove()
+        db.engine.dispose()
+    return db_path
+
+
 @pytest.fixture
-def app():
+def app(template_database):
     """Create and configure a new app instance for each test."""
-    # create a temporary file to isolate the database for each test
+    # copy the template database to isolate the database for each test,
+    # the views and the admin commit, so rolling back a transaction would not undo their changes
     db_fd, db_path = tempfile.mkstemp()
+    shutil.copyfile(template_database, db_path)
     # create the app with common test config
     app = create_app(Config(True, 'sqlite:///' + db_path))
     views.init_views(app)
-    # create the db and load test data
-    with app.app_context():
-        db.drop_all()
-        db.create_all()
-        init_example_database(app)
+    commands.init_commands(app)
     yield app
 
     # close and remove the temporary database
@@ -34,6 +48,21 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def sql_statements(app):
+    """Statements sent to the app's database while the test runs."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
 @pytest.fixture
 def runner(app):
     """A test runner for the app's Click commands."""
@@ -51,3 +51,1149 @@ def fail_test_login(client, auth):
 #        client.get('/')
 #        assert session['user_id'] == 1
 #        assert g.user['email'] == 'admin'
+
+
+def test_catalog_cache(app, client):
+    from datetime import date
+    from iqupdate import db
+    from iqupdate.catalog import catalog
+    from iqupdate.models import ServicePack
+
+    assert b'Version 7.0 0180' not in client.get('/iq7/v1/updates').data
+    with app.app_context():
+        db.session.add(ServicePack(description='Version 7.0 0180', version_number=180,
+                                   release_date=date(2019, 6, 30)))
+        db.session.commit()
+
+    # still served from the cached snapshot
+    assert b'Version 7.0 0180' not in client.get('/iq7/v1/updates').data
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+
+    with app.app_context():
+        generation = catalog.generation
+        catalog.invalidate()
+        assert catalog.generation == generation + 1
+
+    assert b'Version 7.0 0180' in client.get('/iq7/v1/updates').data
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'true'
+
+
+def test_release_note_cache(app, client, sql_statements):
+    from datetime import date, datetime
+    from iqupdate import db
+    from iqupdate.catalog import catalog
+    from iqupdate.models import ServicePack, ServicePackDetail
+
+    def note_queries():
+        return [statement for statement in sql_statements if 'service_pack_detail.contents' in statement]
+
+    german_161 = client.get('/iq7/v1/updates/0161?language=de').data
+    client.get('/iq7/v1/updates/0170?language=de')
+    assert len(note_queries()) == 2
+
+    # Notes of the service packs a change didn't touch survive it
+    add_service_pack(app, 'Version 7.0 0180', date(2019, 6, 30))
+    del sql_statements[:]
+    assert client.get('/iq7/v1/updates/0161?language=de').data == german_161
+    assert not note_queries()
+
+    # Saving a service pack bumps its last_modified, which drops its cached notes
+    with app.app_context():
+        service_pack = ServicePack.query.filter_by(version_number=161).one()
+        service_pack.last_modified = datetime.utcnow()
+        ServicePackDetail.query.filter_by(service_pack_id=service_pack.id, language='de').one().contents = 'Neu'
+        db.session.commit()
+        catalog.invalidate()
+    assert b'Neu' in client.get('/iq7/v1/updates/0161?language=de').data
+    assert len(note_queries()) == 1
+
+    # At most RELEASE_NOTE_CACHE_SIZE notes are kept
+    notes = app.extensions['iqupdate_catalog'].notes
+    notes.size = 1
+    client.get('/iq7/v1/updates/0170?language=en')
+    assert len(notes.items) == 1
+
+
+def test_catalog_invalidated_by_admin(app, client, auth):
+    app.config['WTF_CSRF_ENABLED'] = False
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+
+    auth.login('release', 'release')
+    rv = client.post('/admin/servicepack/new/',
+                     data={'description': 'Version 7.0 0180', 'release_date': '2019-06-30'})
+    assert rv.status_code == 302
+
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'true'
+    assert b'Version 7.0 0180' in client.get('/iq7/v1/updates').data
+
+
+def test_catalog_shared_between_processes(app, client):
+    from datetime import date
+    from sqlalchemy import event
+    from config import Config
+    from iqupdate import create_public_app, db
+
+    # a second process on the same database, e.g. a public update worker
+    other_app = create_public_app(Config(True, app.config['SQLALCHEMY_DATABASE_URI']))
+    other = other_app.test_client()
+    statements = []
+    with other_app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    assert other.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+
+    add_service_pack(app, 'Version 7.0 0180', date(2019, 6, 30))
+    del statements[:]
+    # seen at the next check of the catalog generation, at most CATALOG_CHECK_INTERVAL seconds later
+    assert other.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+    assert statements == []
+    other_app.config['CATALOG_CHECK_INTERVAL'] = 0
+    assert other.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'true'
+    assert len(statements) == 2
+
+    # without a change the check is a single small query
+    del statements[:]
+    assert other.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'true'
+    assert len(statements) == 1
+    assert 'catalog_generation' in statements[0]
+
+
+def test_catalog_without_generation_table(app, client):
+    from datetime import date
+    from config import Config
+    from iqupdate import create_public_app, db
+    from iqupdate.release_models import CatalogGeneration
+
+    # a database not upgraded yet, see deployment/upgrade-mysql.sql
+    with app.app_context():
+        CatalogGeneration.__table__.drop(db.engine)
+    other_app = create_public_app(Config(True, app.config['SQLALCHEMY_DATABASE_URI']))
+    other_app.config['CATALOG_CHECK_INTERVAL'] = 0
+    other = other_app.test_client()
+    assert other.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+    assert other.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+
+    add_service_pack(app, 'Version 7.0 0180', date(2019, 6, 30))
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'true'
+    # the other process only sees the change once its snapshot expires
+    assert other.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+    other_app.config['CATALOG_CACHE_TIMEOUT'] = 0
+    assert other.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'true'
+
+
+def test_conditional_get(client):
+    rv = client.get('/iq7/v1/updates')
+    assert rv.status_code == 200
+    etag = rv.headers['ETag']
+    assert rv.headers['Last-Modified']
+    assert 'max-age=' in rv.headers['Cache-Control']
+
+    rv = client.get('/iq7/v1/updates', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    assert rv.data == b''
+
+    rv = client.get('/iq7/v1/updates?greaterThan=0161', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+
+    rv = client.get('/iq7/v1/updates/0161?language=de')
+    etag = rv.headers['ETag']
+    assert client.get('/iq7/v1/updates/0161?language=de', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/iq7/v1/updates/0161?language=en', headers={'If-None-Match': etag}).status_code == 200
+
+    rv = client.get('/iq7/v1/updates?hasUpdatesFor=0161')
+    rv = client.get('/iq7/v1/updates?hasUpdatesFor=0161',
+                    headers={'If-Modified-Since': rv.headers['Last-Modified']})
+    assert rv.status_code == 304
+
+
+def test_has_updates_for_fast_path(client, sql_statements):
+    from iqupdate.catalog import CatalogSnapshot
+
+    assert not CatalogSnapshot(0, []).has_updates_for(0)
+
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0').data == b'true'
+    del sql_statements[:]
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0169').data == b'true'
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=9999').data == b'false'
+    assert sql_statements == []
+
+
+def test_service_pack_info_query_count(client, sql_statements):
+    # catalog snapshot and one indexed note lookup
+    assert b'Allgemein:' in client.get('/iq7/v1/updates/0161?language=de').data
+    assert len(sql_statements) == 2
+
+    del sql_statements[:]
+    assert b'Allgemein:' in client.get('/iq7/v1/updates/0161?language=de').data
+    assert b'General:' in client.get('/iq7/v1/updates/0170?language=en').data
+    assert len(sql_statements) == 1
+    assert 'service_pack_detail.contents' in sql_statements[0]
+    assert 'service_pack_detail.language' not in sql_statements[0].split('WHERE')[0]
+
+
+def test_updates_batch(client, sql_statements):
+    rv = client.post('/iq7/v1/updates/check',
+                     json={'installed': [161, {'version': 170, 'language': 'de'}, 100, 161]})
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data['newest_version_number'] == 170
+    assert [result['has_updates'] for result in data['results']] == [True, False, True, True]
+    assert data['results'][0]['newer_versions'] == [170]
+    assert data['results'][1]['notes'] == []
+    assert data['results'][2]['newer_versions'] == [161, 170]
+    # one statement for the whole batch, loading the catalog snapshot
+    assert len(sql_statements) == 1
+
+    rv = client.post('/iq7/v1/updates/check', json={'installed': [{'version': 100, 'language': 'de'}]})
+    assert rv.get_json()['results'][0]['notes'][0].endswith('/iq7/v1/updates/0161?language=de')
+
+    assert client.post('/iq7/v1/updates/check', json={'installed': ['x']}).status_code == 400
+    assert client.post('/iq7/v1/updates/check', data='161').status_code == 400
+    assert client.post('/iq7/v1/updates/check', json={'installed': [1] * 1001}).status_code == 400
+
+
+def test_cumulative_notes(app, client, sql_statements):
+    from iqupdate.catalog import catalog
+
+    client.get('/iq7/v1/updates')
+    del sql_statements[:]
+    rv = client.get('/iq7/v1/updates/notes?from=0100&language=de')
+    assert rv.status_code == 200
+    html = rv.data.decode('utf-8')
+    assert 0 < html.index('Version 7.0 0161') < html.index('Allgemein:') < html.index('Version 7.0 0170')
+    # one query for every note of the range, repeating the range is answered from the cache
+    assert len(sql_statements) == 1
+    assert 'ORDER BY service_pack.version_number' in sql_statements[0]
+    assert client.get('/iq7/v1/updates/notes?from=0100&language=de').data == rv.data
+    assert len(sql_statements) == 1
+
+    assert 'Version 7.0 0161' not in client.get('/iq7/v1/updates/notes?from=0161').data.decode('utf-8')
+    assert 'Version 7.0 0170' not in client.get('/iq7/v1/updates/notes?from=0100&to=0169').data.decode('utf-8')
+    assert client.get('/iq7/v1/updates/notes?from=0170').data == b''
+    assert client.get('/iq7/v1/updates/notes').status_code == 400
+    assert client.get('/iq7/v1/updates/notes?from=x').status_code == 400
+
+    app.config['UPDATES_NOTES_STREAM_THRESHOLD'] = 1
+    streamed = client.get('/iq7/v1/updates/notes?from=0100', headers={'Accept-Language': 'de'})
+    assert streamed.is_streamed
+    assert streamed.data == rv.data
+
+    # a catalog change drops the cached ranges with the snapshot
+    app.config['UPDATES_NOTES_STREAM_THRESHOLD'] = 50
+    catalog.invalidate(app)
+    del sql_statements[:]
+    client.get('/iq7/v1/updates/notes?from=0100&language=de')
+    assert len(sql_statements) == 2
+
+
+def test_updates_json(client):
+    rv = client.get('/iq7/v2/updates')
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data['newest_version_number'] == 170
+    assert [sp['version_number'] for sp in data['service_packs']] == [161, 170]
+    assert data['service_packs'][0] == {'version_number': 161, 'release_date': '2018-11-30',
+                                        'description': 'Version 7.0 0161', 'url': '/iq7/v1/updates/0161'}
+    assert data['next'] is None
+
+    data = client.get('/iq7/v2/updates?since=0161').get_json()
+    assert [sp['version_number'] for sp in data['service_packs']] == [170]
+
+    data = client.get('/iq7/v2/updates?fields=version_number&limit=1').get_json()
+    assert data['service_packs'] == [{'version_number': 161}]
+    data = client.get(data['next']).get_json()
+    assert data['service_packs'] == [{'version_number': 170}]
+    assert data['next'] is None
+
+    assert client.get('/iq7/v2/updates?fields=contents').status_code == 400
+    assert client.get('/iq7/v2/updates?limit=0').status_code == 400
+    assert client.get('/iq7/v2/updates?since=x').status_code == 400
+
+
+def test_service_pack_info_gzip(client):
+    import gzip
+
+    plain = client.get('/iq7/v1/updates/0170?language=de')
+    assert 'Content-Encoding' not in plain.headers
+
+    rv = client.get('/iq7/v1/updates/0170?language=de', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in rv.headers['Vary']
+    assert rv.headers['ETag'] != plain.headers['ETag']
+    assert len(rv.data) < len(plain.data) / 2
+    assert gzip.decompress(rv.data) == plain.data
+
+    rv = client.get('/iq7/v1/updates/0170?language=de', headers={'Accept-Encoding': 'identity'})
+    assert rv.data == plain.data
+
+
+def test_metrics(app, client, auth, sql_statements):
+    client.get('/iq7/v1/updates')
+    client.get('/iq7/v1/updates/0161?language=de')
+    client.get('/iq7/v1/updates/0161?language=de')
+
+    # No address is trusted by default, not even the local host a reverse proxy connects from
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 403
+    app.config['METRICS_ALLOWED_ADDRESSES'] = ['127.0.0.1']
+    rv = client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+    assert rv.status_code == 200
+    text = rv.data.decode('utf-8')
+    assert 'iqupdate_request_duration_seconds_count{endpoint="service_pack_info_view"} 2' in text
+    assert 'iqupdate_responses_total{endpoint="updates_view",status="200"} 1' in text
+    assert 'iqupdate_sql_statements_total{endpoint="updates_view"} 1' in text
+    assert 'iqupdate_sql_statements_total{endpoint="service_pack_info_view"} 1' in text
+    assert 'iqupdate_template_render_seconds_total{endpoint="updates_view"}' in text
+
+    remote = {'REMOTE_ADDR': '10.0.0.1'}
+    assert client.get('/metrics', environ_base=remote).status_code == 403
+    app.config['WTF_CSRF_ENABLED'] = False
+    auth.login('release', 'release')
+    assert client.get('/metrics', environ_base=remote).status_code == 403
+    auth.logout()
+    auth.login()
+    assert client.get('/metrics', environ_base=remote).status_code == 200
+    # The superuser check reads the roles from the role cache, not from the database on every scrape
+    del sql_statements[:]
+    assert client.get('/metrics', environ_base=remote).status_code == 200
+    assert not any('roles_users' in statement for statement in sql_statements)
+
+
+def test_metrics_behind_proxy(tmpdir):
+    from config import Config
+    from iqupdate import create_public_app
+
+    class ProxiedConfig(Config):
+        PROXY_FIX_X_FOR = 1
+        METRICS_ALLOWED_ADDRESSES = ['127.0.0.1']
+
+    app = create_public_app(ProxiedConfig(True, 'sqlite:///' + str(tmpdir.join('proxied.db'))))
+    client = app.test_client()
+    proxy = {'REMOTE_ADDR': '127.0.0.1'}
+    assert client.get('/metrics', environ_base=proxy, headers={'X-Forwarded-For': '203.0.113.7'}).status_code == 403
+    assert client.get('/metrics', environ_base=proxy, headers={'X-Forwarded-For': '127.0.0.1'}).status_code == 200
+
+
+def test_synthetic_database(app, client):
+    from iqupdate import db
+    from iqupdate.models import ServicePack, ServicePackDetail
+    from iqupdate.synthetic_database import init_synthetic_database
+
+    with app.app_context():
+        ServicePackDetail.query.delete()
+        ServicePack.query.delete()
+        db.session.commit()
+    init_synthetic_database(app, packs=30, languages=['de', 'en'], note_size=500, batch_size=7)
+    with app.app_context():
+        assert ServicePack.query.count() == 30
+        assert ServicePackDetail.query.count() == 60
+        assert len(ServicePackDetail.query.first().contents) >= 500
+
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0029').data == b'true'
+    assert b'Allgemein:' in client.get('/iq7/v1/updates/0030?language=de').data
+
+
+def test_benchmark_suite():
+    from benchmarks.run import run_suite
+
+    report = run_suite(packs=5, note_size=200, requests=3, warmup=1)
+    assert set(report['results']['has_updates_for']) == {'requests', 'p50_ms', 'p99_ms', 'throughput_rps'}
+    assert report['results']['admin_service_pack_list']['requests'] == 3
+
+
+def test_import_release_notes(app, client, runner, tmpdir):
+    import json
+    from iqupdate.models import ServicePack, ServicePackDetail
+
+    tmpdir.mkdir('0180').join('en.html').write('<p>General: from file</p>')
+    tmpdir.join('manifest.json').write(json.dumps([
+        {'description': 'Version 7.0 0180', 'release_date': '2019-06-30',
+         'notes': {'de': '<p>Allgemein: inline</p>', 'en': {'file': '0180/en.html'}}},
+        {'description': 'Version 7.0 0190', 'release_date': '2019-12-31', 'notes': {'en': '<p>0190</p>'}},
+    ]))
+    csv_manifest = tmpdir.join('notes.csv')
+    csv_manifest.write('description,release_date,language,contents\n'
+                       'Version 7.0 0200,2020-06-30,de,<p>0200 de</p>\n'
+                       'Version 7.0 0200,2020-06-30,en,<p>0200 en</p>\n')
+
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+
+    result = runner.invoke(args=['import-release-notes', str(tmpdir), '--dry-run'])
+    assert result.exit_code == 0, result.output
+    assert 'Checked 2 service packs and 3 notes' in result.output
+    with app.app_context():
+        assert ServicePack.query.count() == 2
+
+    result = runner.invoke(args=['import-release-notes', str(tmpdir), '--batch-size', '1'])
+    assert 'Imported 2 service packs and 3 notes' in result.output
+    result = runner.invoke(args=['import-release-notes', str(csv_manifest)])
+    assert 'Imported 1 service packs and 2 notes' in result.output
+    with app.app_context():
+        assert ServicePack.query.count() == 5
+        assert ServicePackDetail.query.count() == 9
+
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'true'
+    assert b'from file' in client.get('/iq7/v1/updates/0180?language=en').data
+
+    result = runner.invoke(args=['import-release-notes', str(csv_manifest)])
+    assert result.exit_code != 0
+    assert 'already exist: 200' in result.output
+
+    # Invalid rows are reported with their line before anything is written
+    invalid = tmpdir.join('invalid.csv')
+    for rows, message in (
+            ('Version 7.0 0210,2020-12-31,de,ok\nVersion 7.0 next,2020-12-31,de,x\n',
+             "line 3: description 'Version 7.0 next' does not end with a version number"),
+            ('Version 7.0 0210,2020-12-31,de,ok\nVersion 7.0 0210,2021-01-31,en,x\n',
+             'line 3: version 210 is listed twice'),
+            ('Version 7.0 0210,2020-12-31,de,ok\nVersion 7.0 0210,2020-12-31,de,x\n',
+             'line 3: version 210 has two de notes'),
+            ('Version 7.0 0210,2020-12-31,xx,ok\n', "line 2: unknown language 'xx'"),
+            ('Version 7.0 0210,31.12.2020,de,ok\n', "line 2: release_date '31.12.2020' is not a YYYY-MM-DD date")):
+        invalid.write('description,release_date,language,contents\n' + rows)
+        result = runner.invoke(args=['import-release-notes', str(invalid)])
+        assert result.exit_code == 1
+        assert 'Error: {}, {}'.format(invalid, message) in result.output
+        assert 'Traceback' not in result.output
+    tmpdir.join('manifest.json').write(json.dumps([
+        {'description': 'Version 7.0 0210', 'release_date': '2020-12-31'},
+        {'description': 'Version 7.0 0210', 'release_date': '2020-12-31'},
+    ]))
+    result = runner.invoke(args=['import-release-notes', str(tmpdir)])
+    assert 'entry 2: version 210 is listed twice' in result.output
+    with app.app_context():
+        assert ServicePack.query.count() == 5
+
+
+def asgi_get(application, path, query_string=b'', headers=()):
+    import asyncio
+
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string, 'headers': list(headers),
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 1234), 'scheme': 'http', 'http_version': '1.1'}
+    asyncio.run(application(scope, receive, send))
+    return messages[0]['status'], dict(messages[0]['headers']), b''.join(message['body'] for message in messages[1:])
+
+
+def test_asgi_application(app):
+    import asyncio
+    import threading
+    from flask import template_rendered
+    from iqupdate.asgi import CatalogASGIApp
+
+    application = CatalogASGIApp(app)
+    status, headers, body = asgi_get(application, '/iq7/v1/updates', b'hasUpdatesFor=0161')
+    assert (status, body) == (200, b'true')
+
+    # listings are rendered on the pool, not on the event loop's thread, 304s need no rendering
+    rendered_on = []
+    template_rendered.connect(lambda sender, **extra: rendered_on.append(threading.current_thread()), app, weak=False)
+    status, headers, body = asgi_get(application, '/iq7/v1/updates')
+    assert status == 200
+    assert b'Version 7.0 0170' in body
+    assert rendered_on and threading.main_thread() not in rendered_on
+    del rendered_on[:]
+    status, headers, body = asgi_get(application, '/iq7/v1/updates', headers=[(b'if-none-match', headers[b'etag'])])
+    assert status == 304
+    assert not rendered_on
+
+    status, headers, body = asgi_get(application, '/iq7/v1/updates/0161', b'language=de')
+    assert b'Allgemein:' in body
+    assert asgi_get(application, '/iq7/v2/updates')[0] == 200
+
+    # streamed notes are sent chunk by chunk as the application yields them
+    app.config['UPDATES_NOTES_STREAM_THRESHOLD'] = 1
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/iq7/v1/updates/notes', 'query_string': b'from=0100',
+             'headers': [(b'accept-language', b'de')]}
+    asyncio.run(application(scope, receive, send))
+    bodies = [message for message in messages if message['type'] == 'http.response.body']
+    assert len(bodies) > 2
+    assert all(message['more_body'] for message in bodies[:-1]) and not bodies[-1].get('more_body')
+    assert b''.join(message['body'] for message in bodies) == app.test_client().get(
+        '/iq7/v1/updates/notes?from=0100', headers={'Accept-Language': 'de'}).data
+
+    # the admin UI is not served by the ASGI application
+    assert asgi_get(application, '/admin/')[0] == 404
+    assert asgi_get(application, '/admin/servicepack/')[0] == 404
+
+
+def add_service_pack(app, description, release_date):
+    from iqupdate import db
+    from iqupdate.catalog import catalog
+    from iqupdate.models import ServicePack
+
+    with app.app_context():
+        db.session.add(ServicePack(description=description, version_number=int(description.split(' ')[-1]),
+                                   release_date=release_date))
+        db.session.commit()
+        catalog.invalidate()
+
+
+def test_updates_wait(app, client):
+    import threading
+    import time
+    from datetime import date
+
+    # waiting clients are served by the ASGI application, on WSGI only when allowed
+    assert client.get('/iq7/v1/updates/wait?version=0161&timeout=5').status_code == 404
+    app.config['UPDATES_WAIT_ON_WSGI'] = True
+
+    rv = client.get('/iq7/v1/updates/wait?version=0161&timeout=5')
+    assert rv.get_json() == {'version': 161, 'has_updates': True, 'newest_version_number': 170}
+    assert client.get('/iq7/v1/updates/wait?version=0170&timeout=0').get_json()['has_updates'] is False
+    assert client.get('/iq7/v1/updates/wait').status_code == 400
+
+    timer = threading.Timer(0.2, add_service_pack, (app, 'Version 7.0 0180', date(2019, 6, 30)))
+    timer.start()
+    started = time.time()
+    rv = client.get('/iq7/v1/updates/wait?version=0170&timeout=10')
+    timer.join()
+    assert rv.get_json() == {'version': 170, 'has_updates': True, 'newest_version_number': 180}
+    assert time.time() - started < 5
+
+
+def test_updates_events(app, client):
+    assert client.get('/iq7/v1/updates/events?version=0161&timeout=0.2').status_code == 404
+    app.config['UPDATES_WAIT_ON_WSGI'] = True
+    app.config['UPDATES_EVENTS_HEARTBEAT'] = 0.05
+    rv = client.get('/iq7/v1/updates/events?version=0161&timeout=0.2')
+    assert rv.mimetype == 'text/event-stream'
+    body = rv.get_data(as_text=True)
+    assert body.startswith('retry: 50\n\n')
+    assert body.count('event: release') == 1
+    assert '"newest_version_number": 170' in body
+    assert ': keep-alive' in body
+
+
+def test_asgi_updates_wait(app):
+    import asyncio
+    import json
+    import time
+    from datetime import date
+    from config import Config
+    from iqupdate import create_public_app
+    from iqupdate.asgi import CatalogASGIApp
+
+    def long_poll(application, version, description):
+        messages = []
+        received = []
+
+        async def receive():
+            if received:
+                await asyncio.sleep(10)
+                return {'type': 'http.disconnect'}
+            received.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        async def run():
+            scope = {'type': 'http', 'method': 'GET', 'path': '/iq7/v1/updates/wait',
+                     'query_string': 'version={}&timeout=10'.format(version).encode('latin-1'), 'headers': []}
+            waiting = asyncio.ensure_future(application(scope, receive, send))
+            await asyncio.sleep(0.2)
+            assert not messages
+            await asyncio.get_event_loop().run_in_executor(None, add_service_pack, app, description,
+                                                           date(2019, 6, 30))
+            await asyncio.wait_for(waiting, 5)
+
+        started = time.time()
+        asyncio.run(run())
+        assert messages[0]['status'] == 200
+        return json.loads(messages[1]['body']), time.time() - started
+
+    status, elapsed = long_poll(CatalogASGIApp(app), 170, 'Version 7.0 0180')
+    assert status == {'version': 170, 'has_updates': True, 'newest_version_number': 180}
+
+    # waiters of another process wake at its next check of the catalog generation
+    other_app = create_public_app(Config(True, app.config['SQLALCHEMY_DATABASE_URI']))
+    other_app.config['CATALOG_CHECK_INTERVAL'] = 0.1
+    status, elapsed = long_poll(CatalogASGIApp(other_app), 180, 'Version 7.0 0190')
+    assert status == {'version': 180, 'has_updates': True, 'newest_version_number': 190}
+    assert elapsed < 2
+
+
+def test_read_replica_routing(tmpdir):
+    import shutil
+    import time
+    from datetime import date
+    from config import Config
+    from iqupdate import create_app, db, views
+    from iqupdate.example_database import init_example_database
+    from iqupdate.routing import PRIMARY_UNTIL_KEY
+
+    primary_path, replica_path = str(tmpdir.join('primary.db')), str(tmpdir.join('replica.db'))
+    config = Config(True, 'sqlite:///' + primary_path)
+    config.SQLALCHEMY_REPLICA_URIS = ['sqlite:///' + replica_path]
+    config.SQLALCHEMY_REPLICA_LAG = 0
+    config.WTF_CSRF_ENABLED = False
+    app = create_app(config)
+    views.init_views(app)
+    with app.app_context():
+        db.create_all()
+        init_example_database(app)
+    shutil.copyfile(primary_path, replica_path)
+
+    public = app.test_client()
+    assert public.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+    # only the primary knows about 0180, the public views keep reading the replica
+    add_service_pack(app, 'Version 7.0 0180', date(2019, 6, 30))
+    assert public.get('/iq7/v1/updates?hasUpdatesFor=0170').data == b'false'
+
+    admin = app.test_client()
+    admin.post('/admin/login/', data={'email': 'release', 'password': 'release'})
+    assert b'Version 7.0 0180' in admin.get('/admin/servicepack/').data
+
+    app.config['SQLALCHEMY_REPLICA_LAG'] = 60
+    admin.post('/admin/servicepack/new/', data={'description': 'Version 7.0 0190', 'release_date': '2019-12-31'})
+    with admin.session_transaction() as session:
+        assert session[PRIMARY_UNTIL_KEY] > time.time()
+    # read-your-writes, and the catalog reloads from the primary while the replica may lag
+    assert admin.get('/iq7/v2/updates?since=0170').get_json()['newest_version_number'] == 190
+    assert public.get('/iq7/v1/updates?hasUpdatesFor=0180').data == b'true'
+
+
+def test_language_negotiation(app, client):
+    from iqupdate import db, languages
+    from iqupdate.catalog import catalog
+    from iqupdate.models import ServicePack, ServicePackDetail
+
+    with app.app_context():
+        service_pack = ServicePack.query.filter_by(version_number=161).first()
+        db.session.add(ServicePackDetail(service_pack_id=service_pack.id, language='zh', contents='<p>zh notes</p>'))
+        db.session.commit()
+        catalog.invalidate()
+
+    def notes(accept_language, query=''):
+        return client.get('/iq7/v1/updates/0161' + query, headers={'Accept-Language': accept_language}).data
+
+    assert b'Allgemein:' in notes('de-AT, en;q=0.5')
+    assert b'zh notes' in notes('zh-TW')
+    assert b'General:' in notes('fr, it;q=0.8')
+    assert b'General:' in notes('')
+    assert b'zh notes' in notes('de', '?language=zh_TW')
+    assert b'General:' in notes('de', '?language=fr')
+    # 0170 has no Chinese notes, zh-TW falls back to zh and then to the default locale
+    assert b'General:' in client.get('/iq7/v1/updates/0170', headers={'Accept-Language': 'zh-TW'}).data
+
+    app.config['LANGUAGE_FALLBACKS'] = {'fr': ['de']}
+    assert b'Allgemein:' in notes('de', '?language=fr')
+
+    with app.test_request_context(headers={'Accept-Language': 'de-AT'}):
+        assert languages.preferences('de-AT,fr;q=0.9') == ('de_at', 'de', 'fr', 'en')
+        assert languages.best_match(app.config['LANGUAGES']) == 'de'
+        cache = app.extensions['iqupdate_languages']
+        cache.size = 2
+        for header in ('cs', 'ko', 'ja'):
+            languages.preferences(header)
+        assert list(cache.items) == ['ko', 'ja']
+
+
+def test_service_pack_admin_keyset_pagination(app, client, auth, sql_statements):
+    import re
+    from datetime import date
+    from iqupdate import db
+    from iqupdate.models import ServicePack
+    app.config['WTF_CSRF_ENABLED'] = False
+    auth.login('release', 'release')
+    with app.app_context():
+        service_packs = ServicePack.query.order_by(ServicePack.release_date.desc(), ServicePack.id.desc()).all()
+
+    seen = []
+    url = '/admin/servicepack/?page_size=2'
+    while url:
+        rv = client.get(url)
+        assert rv.status_code == 200
+        seen.extend(service_pack.description for service_pack in service_packs
+                    if service_pack.description.encode('utf-8') in rv.data)
+        older = re.search(br'<li class="next">\s*<a href="([^"]+)"', rv.data)
+        url = older.group(1).decode('utf-8').replace('&amp;', '&') if older else None
+    assert seen == [service_pack.description for service_pack in service_packs]
+    # Older pages seek past the previous page's last row instead of counting rows to skip
+    assert any('service_pack.release_date < ?' in statement for statement in sql_statements)
+    assert client.get('/admin/servicepack/?after=yesterday').status_code == 400
+
+    # The total is counted in the database, not taken from a catalog snapshot that may be stale
+    add_service_pack(app, 'Version 7.0 0180', date(2019, 6, 30))
+    with app.app_context():
+        db.session.add(ServicePack(description='Version 7.0 0190', version_number=190,
+                                   release_date=date(2019, 7, 31)))
+        db.session.commit()
+    assert 'List ({})'.format(len(service_packs) + 2).encode('utf-8') in client.get('/admin/servicepack/').data
+
+
+def test_service_pack_admin_deferred_contents(app, client, auth, sql_statements):
+    import json
+    from iqupdate.models import ServicePack, ServicePackDetail
+    app.config['WTF_CSRF_ENABLED'] = False
+    auth.login('release', 'release')
+    with app.app_context():
+        service_pack = ServicePack.query.filter_by(version_number=170).one()
+        detail = service_pack.details[0]
+        service_pack_id, description, release_date = \
+            service_pack.id, service_pack.description, service_pack.release_date
+        detail_id, language, contents = detail.id, detail.language, detail.contents
+
+    del sql_statements[:]
+    rv = client.get('/admin/servicepack/edit/?id={}'.format(service_pack_id))
+    assert rv.status_code == 200
+    assert 'Show contents' in rv.data.decode('utf-8')
+    assert not any('contents' in statement for statement in sql_statements)
+
+    rv = client.get('/admin/servicepack/details/{}/contents'.format(detail_id))
+    assert json.loads(rv.data.decode('utf-8')) == {'id': detail_id, 'language': language, 'contents': contents}
+
+    # Saving without showing the note keeps it, a shown and edited note is stored
+    form = {'description': description, 'release_date': release_date.isoformat(),
+            'details-0-id': str(detail_id), 'details-0-language': language, 'details-0-note': ''}
+    assert client.post('/admin/servicepack/edit/?id={}'.format(service_pack_id), data=form).status_code == 302
+    with app.app_context():
+        assert ServicePackDetail.query.get(detail_id).contents == contents
+    form['details-0-note'] = '<p>Edited</p>'
+    assert client.post('/admin/servicepack/edit/?id={}'.format(service_pack_id), data=form).status_code == 302
+    with app.app_context():
+        assert ServicePackDetail.query.get(detail_id).contents == '<p>Edited</p>'
+
+
+def test_service_pack_admin_delete(app, client, auth, sql_statements):
+    from flask import get_flashed_messages
+    from iqupdate.forms import ServicePackAdmin
+    from iqupdate.models import ServicePack, ServicePackDetail
+    app.config['WTF_CSRF_ENABLED'] = False
+    auth.login('release', 'release')
+    with app.app_context():
+        ids = [service_pack.id for service_pack in ServicePack.query.order_by(ServicePack.id)]
+
+    # The bulk delete honours can_delete like Flask-Admin's own action
+    view = next(view for view in app.extensions['admin'][0]._views if isinstance(view, ServicePackAdmin))
+    view.can_delete = False
+    try:
+        with app.test_request_context():
+            view.action_delete([str(ids[0])])
+            assert get_flashed_messages(category_filter=['error'])
+            assert ServicePack.query.get(ids[0]) is not None
+    finally:
+        del view.can_delete
+
+    rv = client.post('/admin/servicepack/delete/', data={'id': str(ids[0])})
+    assert rv.status_code == 302
+    with app.app_context():
+        assert ServicePack.query.get(ids[0]) is None
+        assert ServicePackDetail.query.filter_by(service_pack_id=ids[0]).count() == 0
+
+    del sql_statements[:]
+    rv = client.post('/admin/servicepack/action/', data={'action': 'delete', 'rowid': [str(i) for i in ids[1:]]})
+    assert rv.status_code == 302
+    assert len([statement for statement in sql_statements if statement.startswith('DELETE')]) == 2
+    with app.app_context():
+        assert ServicePack.query.count() == 0
+        assert ServicePackDetail.query.count() == 0
+    assert client.get('/iq7/v1/updates?hasUpdatesFor=0001').data == b'false'
+
+
+def test_role_cache(app, client, auth, sql_statements):
+    from iqupdate.models import Role, User
+    app.config['WTF_CSRF_ENABLED'] = False
+    auth.login('admin', 'admin')
+    assert client.get('/admin/user/').status_code == 200
+
+    del sql_statements[:]
+    assert client.get('/admin/role/').status_code == 200
+    assert not any('roles_users' in statement for statement in sql_statements)
+
+    # Taking superuser away from admin shows up on the next request
+    with app.app_context():
+        admin = User.query.filter_by(email='admin').one()
+        role_ids = [str(role.id) for role in admin.roles if role.name != 'superuser']
+        superuser = Role.query.filter_by(name='superuser').one()
+        admin_id, admin_email, superuser_id = admin.id, admin.email, superuser.id
+    rv = client.post('/admin/user/edit/?id={}'.format(admin_id),
+                     data={'email': admin_email, 'active': 'y', 'roles': role_ids})
+    assert rv.status_code == 302
+    with app.app_context():
+        assert superuser_id not in [role.id for role in User.query.get(admin_id).roles]
+    assert client.get('/admin/role/').status_code == 403
+
+
+def test_login_password_verification(app, client):
+    from passlib.context import CryptContext
+    from passlib.hash import pbkdf2_sha512
+    from flask_security.utils import get_hmac
+    from iqupdate import db
+    from iqupdate.models import User
+    from config import Config
+    from iqupdate import create_app, views
+    from iqupdate.passwords import _needs_rehash
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    # Hashes with fewer rounds than configured are replaced, hashes with more are kept
+    with app.app_context():
+        password_hash = pbkdf2_sha512.using(rounds=2000).hash(get_hmac('release'))
+    assert not _needs_rehash(CryptContext(schemes=['pbkdf2_sha512']), password_hash, {'rounds': 1000})
+    assert _needs_rehash(CryptContext(schemes=['pbkdf2_sha512']), password_hash, {'rounds': 3000})
+
+    def login_and_get_hash(stored_hash):
+        with app.app_context():
+            User.query.filter_by(email='release').one().password = stored_hash
+            db.session.commit()
+        rv = client.post('/admin/login/', data={'email': 'release', 'password': 'release'})
+        assert rv.status_code == 302
+        client.get('/admin/logout/')
+        with app.app_context():
+            return User.query.filter_by(email='release').one().password
+
+    # Testing uses the real scheme at a low cost, which never downgrades a stronger hash
+    assert app.config['SECURITY_PASSWORD_HASH_OPTIONS'] == {'pbkdf2_sha512': {'rounds': 1000}}
+    assert login_and_get_hash(password_hash) == password_hash
+    with app.app_context():
+        weaker_hash = pbkdf2_sha512.using(rounds=500).hash(get_hmac('release'))
+    assert pbkdf2_sha512.from_string(login_and_get_hash(weaker_hash)).rounds == 1000
+    # Hashes of a deprecated scheme are replaced
+    assert login_and_get_hash('release').startswith('$pbkdf2-sha512$1000$')
+
+    # Also when testing is only turned on by create_app
+    testing_app = create_app(Config, testing=True)
+    views.init_views(testing_app)
+    assert testing_app.config['SECURITY_PASSWORD_HASH_OPTIONS'] == {'pbkdf2_sha512': {'rounds': 1000}}
+
+    # Logins beyond the thread and queue slots are turned away
+    state = app.extensions['iqupdate_passwords']
+    taken = app.config['LOGIN_VERIFY_THREADS'] + app.config['LOGIN_VERIFY_QUEUE']
+    for _ in range(taken):
+        state.slots.acquire()
+    try:
+        assert client.post('/admin/login/', data={'email': 'release', 'password': 'release'}).status_code == 503
+    finally:
+        for _ in range(taken):
+            state.slots.release()
+
+    # Attempts are throttled per client address
+    state.attempts.clear()
+    app.config['LOGIN_ATTEMPTS'] = 1
+    rv = client.post('/admin/login/', data={'email': 'release', 'password': 'wrong'})
+    assert rv.status_code == 200
+    rv = client.post('/admin/login/', data={'email': 'release', 'password': 'wrong'})
+    assert rv.status_code == 429
+    assert int(rv.headers['Retry-After']) > 0
+    assert client.post('/admin/login/', data={'email': 'release', 'password': 'release'},
+                       environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 302
+
+
+def test_login_throttle_behind_proxy(app):
+    from config import Config
+    from iqupdate import create_app, views
+
+    class ProxiedConfig(Config):
+        PROXY_FIX_X_FOR = 1
+        LOGIN_ATTEMPTS = 1
+        WTF_CSRF_ENABLED = False
+
+    proxied = create_app(ProxiedConfig(True, app.config['SQLALCHEMY_DATABASE_URI']))
+    views.init_views(proxied)
+    client = proxied.test_client()
+
+    def login(client_address):
+        return client.post('/admin/login/', data={'email': 'release', 'password': 'wrong'},
+                           environ_base={'REMOTE_ADDR': '127.0.0.1'}, headers={'X-Forwarded-For': client_address})
+
+    # Clients behind the same proxy are throttled each on its own
+    assert login('203.0.113.7').status_code == 200
+    assert login('203.0.113.7').status_code == 429
+    assert login('203.0.113.8').status_code == 200
+
+
+def test_public_app(tmpdir):
+    import os
+    import subprocess
+    import sys
+    script = '''
+import sys
+from config import Config
+from iqupdate import create_public_app, db
+config = Config(True, {uri!r})
+config.SQLALCHEMY_ECHO = False
+app = create_public_app(config)
+with app.app_context():
+    db.create_all()
+client = app.test_client()
+assert client.get('/iq7/v1/updates?hasUpdatesFor=0161').data == b'false'
+assert client.get('/admin/').status_code == 404
+print(sorted(name for name in sys.modules if name.split('.')[0] in ('flask_admin', 'flask_security', 'wtforms')))
+'''.format(uri='sqlite:///' + str(tmpdir.join('public.db')))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+    assert output.decode('utf-8').strip().splitlines()[-1] == '[]'
+
+
+def test_logging(app, client, tmpdir):
+    import json
+    from iqupdate.log import init_logging, stop_logging
+    app.config.update(LOG_DIR=str(tmpdir), LOG_ACCESS_JSON=True, LOG_404_SAMPLE_RATE=1.0)
+    init_logging(app)
+    try:
+        assert client.get('/iq7/v1/updates?hasUpdatesFor=0161').status_code == 200
+        assert client.get('/wp-login.php').status_code == 404
+        app.config['LOG_404_SAMPLE_RATE'] = 0.0
+        assert client.get('/phpmyadmin/').status_code == 404
+    finally:
+        stop_logging(app)
+
+    access = [json.loads(line) for line in tmpdir.join('access.log').read().splitlines()]
+    assert [(entry['path'], entry['status']) for entry in access] == [
+        ('/iq7/v1/updates', 200), ('/wp-login.php', 404), ('/phpmyadmin/', 404)]
+    assert all(entry['duration_ms'] >= 0 for entry in access)
+    log = tmpdir.join('iq_update.log').read()
+    assert '/wp-login.php' in log
+    assert '/phpmyadmin/' not in log
+    assert '"status"' not in log
+
+
+def test_logging_after_fork(app, tmpdir):
+    import os
+    from iqupdate.log import init_logging, stop_logging
+    app.config.update(LOG_DIR=str(tmpdir))
+    init_logging(app)
+    try:
+        app.logger.info('Logged by the parent')
+        # A gunicorn worker forked from the master the application was preloaded in
+        pid = os.fork()
+        if pid == 0:
+            try:
+                app.logger.info('Logged by the worker')
+                stop_logging(app)
+            finally:
+                os._exit(0)
+        assert os.waitpid(pid, 0)[1] == 0
+        app.logger.info('Logged by the parent again')
+    finally:
+        stop_logging(app)
+
+    log = tmpdir.join('iq_update.log').read()
+    # The worker wrote its record through a listener of its own, the parent's queue was not written twice
+    assert log.count('Logged by the parent [') == 1
+    assert log.count('Logged by the worker [') == 1
+    assert log.count('Logged by the parent again [') == 1
+
+
+def test_logging_rotated_externally(app, tmpdir):
+    import os
+    from iqupdate.log import _installed, init_logging, stop_logging
+    app.config.update(LOG_DIR=str(tmpdir))
+    init_logging(app)
+
+    def write_queued():
+        _installed[app.logger.name][0].queue.join()
+
+    try:
+        rotated, moved = os.pipe(), os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                app.logger.info('Worker before rotation')
+                write_queued()
+                os.write(rotated[1], b'x')
+                os.read(moved[0], 1)
+                app.logger.info('Worker after rotation')
+                stop_logging(app)
+            finally:
+                os._exit(0)
+        app.logger.info('Parent before rotation')
+        write_queued()
+        os.read(rotated[0], 1)
+        # logrotate moves the file, every worker reopens it at its next batch
+        tmpdir.join('iq_update.log').rename(tmpdir.join('iq_update.log.1'))
+        os.write(moved[1], b'x')
+        app.logger.info('Parent after rotation')
+        assert os.waitpid(pid, 0)[1] == 0
+    finally:
+        stop_logging(app)
+
+    rotated_log = tmpdir.join('iq_update.log.1').read()
+    assert 'Worker before rotation [' in rotated_log
+    assert 'Parent before rotation [' in rotated_log
+    assert 'after rotation' not in rotated_log
+    log = tmpdir.join('iq_update.log').read()
+    assert 'Worker after rotation [' in log
+    assert 'Parent after rotation [' in log
+    assert 'before rotation' not in log
+
+
+def test_static_export(app, client, auth, runner, tmpdir):
+    import fcntl
+    import gzip
+    import os
+    import threading
+    from iqupdate.models import ServicePack
+    from iqupdate.static_export import static_export
+
+    def export_in_app_context():
+        with app.app_context():
+            return static_export.export()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['STATIC_EXPORT_DIR'] = str(tmpdir)
+    result = runner.invoke(args=['export-static'])
+    assert result.exit_code == 0, result.output
+    updates = tmpdir.join('current', 'iq7', 'v1', 'updates')
+    assert updates.join('hasUpdatesFor', '161').read() == 'true'
+    assert updates.join('hasUpdatesFor', '170').read() == 'false'
+    assert updates.join('index.html').read_binary() == client.get('/iq7/v1/updates').data
+    assert 'Service Pack' not in updates.join('index.zh.html').read_text('utf-8')
+    note = updates.join('170', 'de.html')
+    assert note.read_binary() == client.get('/iq7/v1/updates/0170', headers={'Accept-Language': 'de'}).data
+    assert gzip.decompress(updates.join('170', 'de.html.gz').read_binary()) == note.read_binary()
+    first_tree = os.path.realpath(str(tmpdir.join('current')))
+
+    # Saving a service pack updates the current tree in place, the other service packs' files are not rewritten
+    auth.login('release', 'release')
+    unchanged = [str(updates.join('161', 'de.html')), str(updates.join('hasUpdatesFor', '161'))]
+    unchanged_inodes = [os.stat(path).st_ino for path in unchanged]
+    rv = client.post('/admin/servicepack/new/', data={'description': 'Version 7.0 0180', 'release_date': '2019-06-30'})
+    assert rv.status_code == 302
+    assert os.path.realpath(str(tmpdir.join('current'))) == first_tree
+    assert updates.join('hasUpdatesFor', '170').read() == 'true'
+    assert updates.join('hasUpdatesFor', '180').read() == 'false'
+    assert b'Version 7.0 0180' in updates.join('index.html').read_binary()
+    assert [os.stat(path).st_ino for path in unchanged] == unchanged_inodes
+    assert not [name for name in os.listdir(str(updates.join('hasUpdatesFor'))) if name.endswith('.tmp')]
+
+    # Deleting it removes its files and makes 170 the newest again
+    with app.app_context():
+        service_pack_id = ServicePack.query.filter_by(version_number=180).one().id
+    rv = client.post('/admin/servicepack/action/', data={'action': 'delete', 'rowid': [str(service_pack_id)]})
+    assert rv.status_code == 302
+    assert not updates.join('hasUpdatesFor', '180').exists()
+    assert not updates.join('hasUpdatesFor', '180.gz').exists()
+    assert updates.join('hasUpdatesFor', '170').read() == 'false'
+    assert b'Version 7.0 0180' not in updates.join('index.html').read_binary()
+    assert [os.stat(path).st_ino for path in unchanged] == unchanged_inodes
+
+    # Another worker holding the lock file keeps exports waiting, so they never remove its tree
+    with open(str(tmpdir.join('.lock')), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        current_tree = os.path.realpath(str(tmpdir.join('current')))
+        exports = []
+        export = threading.Thread(target=lambda: exports.append(export_in_app_context()))
+        export.start()
+        export.join(0.3)
+        assert export.is_alive()
+        assert [name for name in os.listdir(str(tmpdir)) if name.startswith('tree-')] == \
+            [os.path.basename(current_tree)]
+    export.join(10)
+    assert os.path.realpath(str(tmpdir.join('current'))) == exports[0] != current_tree
+
+
+def test_admin_without_fcntl():
+    import os
+    import subprocess
+    import sys
+    # As on Windows: the export's lock is only needed with STATIC_EXPORT_DIR set
+    script = '''
+import sys
+sys.modules['fcntl'] = None
+from config import Config
+from iqupdate import create_app, views
+views.init_views(create_app(Config, testing=True))
+'''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.check_call([sys.executable, '-c', script], cwd=root)
+
+
+def test_slow_query_log(app, client):
+    from iqupdate.slow_queries import normalize, slow_query_log
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    assert normalize("SELECT a FROM t WHERE id IN (?, ?,?) AND name = 'x''y'\n AND n > 5") == \
+        'SELECT a FROM t WHERE id IN (...) AND name = ? AND n > ?'
+    assert normalize('SELECT t1.a FROM t1 WHERE id = %(id_1)s LIMIT %s') == 'SELECT t1.a FROM t1 WHERE id = ? LIMIT ?'
+
+    app.config['SLOW_QUERY_THRESHOLD'] = 0
+    client.get('/iq7/v1/updates/0161?language=de')
+    client.get('/iq7/v1/updates/0170?language=de')
+    with app.app_context():
+        statements = slow_query_log.statements()
+    note = [statement for statement in statements if 'service_pack_detail.contents' in statement.shape][0]
+    assert note.count == 2
+    assert note.endpoints == {'service_pack_info_view': 2}
+    assert "'de'" in note.last_parameters
+    # the plan of the first occurrence, from the index on (service_pack_id, language)
+    assert 'ix_service_pack_detail_service_pack_id_language' in '\n'.join(note.explain)
+
+    # superusers only
+    assert client.get('/admin/slow_queries/').status_code == 302
+    client.post('/admin/login/', data={'email': 'release', 'password': 'release'})
+    assert client.get('/admin/slow_queries/').status_code == 403
+    client.get('/admin/logout/')
+    client.post('/admin/login/', data={'email': 'admin', 'password': 'admin'})
+    rv = client.get('/admin/slow_queries/')
+    assert rv.status_code == 200
+    assert b'service_pack_info_view (2)' in rv.data
+
+    app.config['SLOW_QUERY_THRESHOLD'] = None
+    client.get('/iq7/v1/updates/0161?language=de')
+    with app.app_context():
+        assert [statement.count for statement in slow_query_log.statements() if statement.shape == note.shape] == [2]
+
+
+def test_sql_timing_failed_statement(app):
+    import pytest
+    from sqlalchemy.exc import OperationalError
+    from iqupdate import db, sql_timing
+
+    timed = []
+
+    def record(conn, cursor, statement, parameters, executemany, duration):
+        timed.append(statement)
+
+    sql_timing.on_statement(record)
+    try:
+        with app.app_context():
+            with db.engine.connect() as connection:
+                for _ in range(3):
+                    with pytest.raises(OperationalError):
+                        connection.execute('SELECT * FROM no_such_table')
+                connection.execute('SELECT 1')
+                # A failing statement leaves no start time behind on the connection
+                assert not connection.info.get('iqupdate_query_started')
+    finally:
+        sql_timing._listeners.remove(record)
+    assert timed == ['SELECT 1']
+
+
+def test_warm_up(app, client, sql_statements):
+    from collections import namedtuple
+    from babel import Locale
+    from flask_admin.babel import domain as admin_domain
+    from iqupdate import gunicorn_config
+    from iqupdate.catalog import catalog
+
+    server = namedtuple('Server', 'app')(namedtuple('WSGIApplication', 'wsgi')(lambda: app))
+    gunicorn_config.when_ready(server)
+    assert {'service_packs.html', 'admin/index.html'} <= set(name for loader, name in app.jinja_env.cache.keys())
+    assert set(str(Locale.parse(language)) for language in app.config['LANGUAGES']) <= set(admin_domain.cache)
+    assert not catalog.is_loaded(app)
+
+    gunicorn_config.pre_fork(server, None)
+    worker = namedtuple('Worker', 'wsgi cfg')(app, namedtuple('Config', 'threads')(2))
+    gunicorn_config.post_worker_init(worker)
+    assert catalog.is_loaded(app)
+
+    # the first request of the worker is answered without compiling templates or loading the catalog
+    del sql_statements[:]
+    assert client.get('/iq7/v1/updates').status_code == 200
+    assert sql_statements == []